@@ -2,14 +2,18 @@ import streamlit as st
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
-import json
+import hashlib
+import mmap
 import os
+import re
 from datetime import datetime
-import plotly.express as px
 import time
+import orjson
 
 import simulation_engine as engine
+import fast_percentiles
 
 # --- CONFIGURAZIONE PAGINA ---
 st.set_page_config(
@@ -18,23 +22,110 @@ st.set_page_config(
     layout="wide"
 )
 
+# Compila il kernel dei percentili all'avvio (operazione istantanea dopo la prima volta)
+fast_percentiles.warmup()
+
+# Serializzazione delle figure (st.plotly_chart -> plotly.io.to_json) sempre con
+# orjson, dipendenza obbligatoria dell'app: "auto" ripiegherebbe in silenzio sul
+# modulo json se orjson mancasse. I NaN che separano le traiettorie del grafico
+# spaghetti vengono convertiti in null dall'encoder di Plotly.
+pio.json.config.default_engine = 'orjson'
+
 # --- FUNZIONI HELPER ---
 
-class NpEncoder(json.JSONEncoder):
-    """ Encoder JSON custom per gestire i tipi di dati NumPy. """
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NpEncoder, self).default(obj)
+def _orjson_default(obj):
+    """
+    Fallback per i tipi che orjson non serializza nativamente (es. array NumPy
+    non contigui o con dtype non supportati).
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Tipo non serializzabile: {type(obj).__name__}")
+
+# Separatore usato per appiattire le chiavi annidate dei risultati nel file .npz
+SEPARATORE_CHIAVI_NPZ = '.'
+
+def _separa_array(results, prefisso=''):
+    """
+    Separa gli array NumPy dai valori scalari in un dizionario di risultati
+    (anche annidato).
+
+    Args:
+        results (dict): Risultati della simulazione.
+        prefisso (str): Prefisso delle chiavi (usato nella ricorsione).
+
+    Returns:
+        tuple: (dizionario senza array, dizionario piatto chiave -> array).
+    """
+    scalari, array = {}, {}
+    for chiave, valore in results.items():
+        chiave_piatta = f"{prefisso}{chiave}"
+        if isinstance(valore, dict):
+            sotto_scalari, sotto_array = _separa_array(valore, chiave_piatta + SEPARATORE_CHIAVI_NPZ)
+            scalari[chiave] = sotto_scalari
+            array.update(sotto_array)
+        elif isinstance(valore, np.ndarray):
+            array[chiave_piatta] = valore
+        else:
+            scalari[chiave] = valore
+    return scalari, array
+
+def _ricomponi_array(scalari, array):
+    """
+    Operazione inversa di `_separa_array`: reinserisce gli array nella
+    struttura annidata dei risultati.
+
+    Args:
+        scalari (dict): Risultati senza array (letti dal JSON).
+        array (Mapping): Chiave piatta -> array (letti dal .npz).
+
+    Returns:
+        dict: I risultati completi.
+    """
+    for chiave_piatta in array:
+        *percorso, ultima = chiave_piatta.split(SEPARATORE_CHIAVI_NPZ)
+        nodo = scalari
+        for chiave in percorso:
+            nodo = nodo.setdefault(chiave, {})
+        nodo[ultima] = array[chiave_piatta]
+    return scalari
+
+def _scrivi_json_a_blocchi(f, data):
+    """
+    Scrive un dizionario su file come oggetto JSON, serializzando con orjson una
+    voce alla volta (e i risultati una chiave alla volta): in memoria non c'è
+    mai la stringa JSON dell'intero salvataggio.
+
+    Args:
+        f: File aperto in scrittura binaria.
+        data (dict): Dati da salvare.
+    """
+    # orjson serializza gli array NumPy direttamente dal buffer, senza passare da liste Python
+    opzioni = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    f.write(b'{')
+    for i, (chiave, valore) in enumerate(data.items()):
+        if i:
+            f.write(b',')
+        f.write(b'\n' + orjson.dumps(chiave) + b':')
+        if chiave == 'results' and isinstance(valore, dict):
+            f.write(b'{')
+            for j, (k, v) in enumerate(valore.items()):
+                if j:
+                    f.write(b',')
+                f.write(b'\n' + orjson.dumps(str(k)) + b':')
+                f.write(orjson.dumps(v, default=_orjson_default, option=opzioni))
+            f.write(b'}')
+        else:
+            f.write(orjson.dumps(valore, default=_orjson_default, option=opzioni))
+    f.write(b'\n}\n')
 
 def save_simulation(name, params, results):
     """
-    Salva i parametri e i risultati completi di una simulazione in un file JSON
-    in una sottodirectory dedicata.
+    Salva una simulazione nella sottodirectory dedicata: parametri e valori
+    scalari in un file JSON, gli array dei risultati in un file `.npz`
+    compresso con lo stesso nome (molto più compatto e veloce da rileggere).
 
     Args:
         name (str): Il nome dato dall'utente alla simulazione.
@@ -46,50 +137,554 @@ def save_simulation(name, params, results):
     os.makedirs(history_dir, exist_ok=True)
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{name.replace(' ', '_')}.json"
+    # Solo caratteri sicuri nel nome file (il nome di default contiene "/" e ":")
+    nome_file = re.sub(r'[^\w\-]+', '_', name).strip('_')
+    filename = f"{timestamp}_{nome_file}.json"
     filepath = os.path.join(history_dir, filename)
+
+    results_scalari, results_array = _separa_array(results)
+    np.savez_compressed(os.path.splitext(filepath)[0] + '.npz', **results_array)
     
     data_to_save = {
         "simulation_name": name,
         "timestamp": timestamp,
         "parameters": params,
-        "results": results
+        "results": results_scalari
     }
     
-    with open(filepath, 'w') as f:
-        json.dump(data_to_save, f, cls=NpEncoder, indent=4)
+    with open(filepath, 'wb') as f:
+        _scrivi_json_a_blocchi(f, data_to_save)
+    # Lo storico è cambiato: invalida l'elenco dei file in cache
+    load_simulation_files.clear()
     st.success(f"Risultati salvati con successo in `{filepath}`")
 
+@st.cache_data(ttl=10)
 def load_simulation_files():
     """
     Carica e restituisce una lista ordinata dei file di simulazione JSON
-    trovati nella directory 'simulation_history'.
+    trovati nella directory 'simulation_history' (i file `.npz` associati
+    non compaiono nell'elenco), insieme alla loro data di ultima modifica.
+    Il risultato è in cache per evitare di rileggere la directory a ogni rerun;
+    la cache viene svuotata quando si salva o si elimina una simulazione.
     
     Returns:
-        list: Una lista di stringhe con i nomi dei file, ordinati dal più recente.
+        list: Coppie (nome file, timestamp di ultima modifica), dalla più recente.
     """
     history_dir = 'simulation_history'
     if not os.path.exists(history_dir):
         return []
-    files = [f for f in os.listdir(history_dir) if f.endswith('.json')]
-    return sorted(files, reverse=True)
+    # Un'unica scansione fornisce nome, tipo e data di modifica di ogni file
+    with os.scandir(history_dir) as voci:
+        files = [
+            (voce.name, voce.stat().st_mtime)
+            for voce in voci if voce.is_file() and voce.name.endswith('.json')
+        ]
+    files.sort(key=lambda voce: voce[1], reverse=True)
+    return files
+
+# Oltre questa dimensione il JSON viene letto tramite mmap invece che con f.read()
+SOGLIA_MMAP_BYTES = 10 * 1024 * 1024
+
+def _leggi_json(filepath):
+    """
+    Legge e decodifica un file JSON con orjson. I file grandi (vecchi salvataggi
+    con tutti gli array nel JSON) vengono mappati in memoria, evitando di
+    copiarne l'intero contenuto in un oggetto bytes.
+
+    Args:
+        filepath (str): Percorso del file JSON.
+
+    Returns:
+        Il contenuto decodificato.
+    """
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= SOGLIA_MMAP_BYTES:
+            return orjson.loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buffer:
+            return orjson.loads(buffer)
+
+def _array_da_liste(results):
+    """
+    Nei salvataggi senza file `.npz` gli array dei risultati sono liste JSON:
+    le riconverte in array NumPy, limitandosi alle chiavi che contengono
+    matrici o serie numeriche.
+
+    Args:
+        results (dict): Risultati letti dal JSON.
+
+    Returns:
+        dict: Gli stessi risultati, con gli array ricostruiti.
+    """
+    def _converti(contenitore, chiave):
+        if isinstance(contenitore.get(chiave), list):
+            contenitore[chiave] = np.asarray(contenitore[chiave], dtype=np.float32)
+
+    for chiave in list(results.get('dati_grafici_principali', {})):
+        _converti(results['dati_grafici_principali'], chiave)
+    dati_mediana = results.get('dati_grafici_avanzati', {}).get('dati_mediana', {})
+    for chiave in list(dati_mediana):
+        _converti(dati_mediana, chiave)
+    if 'statistiche' in results:
+        _converti(results['statistiche'], 'patrimoni_reali_finali')
+    return results
+
+def _mediana_strutturata(dati_mediana):
+    """
+    I salvataggi meno recenti contengono i dati dello scenario mediano come
+    dizionario di serie separate: li riunisce nello stesso array strutturato
+    (un campo per serie) prodotto dal motore di simulazione.
+
+    Args:
+        dati_mediana (dict | np.ndarray): Dati annuali dello scenario mediano.
+
+    Returns:
+        np.ndarray: Array strutturato con un campo `float32` per ogni serie.
+    """
+    if isinstance(dati_mediana, np.ndarray):
+        return dati_mediana
+    lunghezza = len(next(iter(dati_mediana.values()), ()))
+    strutturato = np.empty(lunghezza, dtype=[(chiave, np.float32) for chiave in dati_mediana])
+    for chiave, serie in dati_mediana.items():
+        strutturato[chiave] = serie
+    return strutturato
 
 def load_simulation_data(filename):
     """
-    Carica i dati di una specifica simulazione da un file JSON.
+    Carica i dati di una specifica simulazione: il file JSON e, se presente,
+    il file `.npz` con gli array dei risultati (i salvataggi meno recenti
+    contengono tutto nel JSON).
 
     Args:
-        filename (str): Il nome del file da caricare.
+        filename (str): Il nome del file JSON da caricare.
 
     Returns:
         dict: I dati della simulazione (parametri e risultati).
     """
     filepath = os.path.join('simulation_history', filename)
-    with open(filepath, 'r') as f:
-        return json.load(f)
+    data = _leggi_json(filepath)
+
+    filepath_npz = os.path.splitext(filepath)[0] + '.npz'
+    if os.path.exists(filepath_npz):
+        with np.load(filepath_npz) as array:
+            data['results'] = _ricomponi_array(data['results'], {k: array[k] for k in array.files})
+    else:
+        data['results'] = _array_da_liste(data['results'])
+    # I salvataggi precedenti possono contenere array float64 e serie separate:
+    # stesso formato di una nuova simulazione
+    data['results'] = converti_in_float32(data['results'])
+    avanzati = data['results'].get('dati_grafici_avanzati')
+    if avanzati and 'dati_mediana' in avanzati:
+        avanzati['dati_mediana'] = _mediana_strutturata(avanzati['dati_mediana'])
+    return data
+
+def delete_simulation(filename):
+    """
+    Elimina una simulazione salvata (file JSON ed eventuale file `.npz`).
+
+    Args:
+        filename (str): Il nome del file JSON da eliminare.
+    """
+    filepath = os.path.join('simulation_history', filename)
+    filepath_npz = os.path.splitext(filepath)[0] + '.npz'
+    os.remove(filepath)
+    if os.path.exists(filepath_npz):
+        os.remove(filepath_npz)
+    load_simulation_files.clear()
+
+def converti_in_float32(obj):
+    """
+    Converte ricorsivamente in `float32` tutti gli array NumPy `float64` contenuti
+    nei risultati della simulazione. Per importi in euro la precisione singola è
+    più che sufficiente e dimezza la memoria occupata, il costo dei percentili e
+    il peso dei dati inviati al browser con i grafici.
+
+    Args:
+        obj: Risultati (dict, list o array) restituiti dal motore di simulazione.
+
+    Returns:
+        Lo stesso oggetto, con gli array float64 sostituiti dalla versione float32.
+    """
+    if isinstance(obj, dict):
+        return {k: converti_in_float32(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [converti_in_float32(v) for v in obj]
+    if isinstance(obj, np.ndarray) and obj.dtype == np.float64:
+        return obj.astype(np.float32)
+    if isinstance(obj, np.ndarray) and obj.dtype.names:
+        # Array strutturato (dati dello scenario mediano): stessi campi, in float32
+        return obj.astype([(nome, np.float32) for nome in obj.dtype.names])
+    return obj
+
+def _congela(valore):
+    """
+    Rende hashable un valore dei parametri, convertendo ricorsivamente liste e
+    dizionari in tuple.
+    """
+    if isinstance(valore, dict):
+        return tuple(sorted((k, _congela(v)) for k, v in valore.items()))
+    if isinstance(valore, (list, tuple)):
+        return tuple(_congela(v) for v in valore)
+    return valore
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _cached_run(params_tuple, versione_motore):
+    """
+    Esegue la simulazione completa memorizzando il risultato: premere di nuovo
+    "Esegui Simulazione" con parametri identici restituisce subito i risultati
+    già calcolati invece di ripetere il Monte Carlo.
+
+    Args:
+        params_tuple (tuple): Parametri congelati con `_congela`.
+        versione_motore (float): Data di modifica di `simulation_engine.py`,
+            così la cache si invalida quando cambia il codice del motore.
+
+    Returns:
+        dict: I risultati della simulazione (array già in float32).
+    """
+    return converti_in_float32(engine.run_full_simulation(dict(params_tuple)))
+
+def safe_div(num, den, default=0.0):
+    """
+    Divisione protetta: restituisce `default` dove il denominatore non è positivo.
+    Accetta sia scalari sia array NumPy.
+
+    Args:
+        num: Numeratore (scalare o array).
+        den: Denominatore (scalare o array).
+        default (float): Valore usato quando il denominatore è <= 0.
+
+    Returns:
+        Il rapporto, con `default` al posto delle divisioni non valide.
+    """
+    if np.ndim(num) == 0 and np.ndim(den) == 0:
+        return num / den if den > 0 else default
+    num, den = np.broadcast_arrays(np.asarray(num, dtype=float), np.asarray(den, dtype=float))
+    return np.divide(num, den, out=np.full(num.shape, default, dtype=float), where=den > 0)
+
+# Percentili usati per i "coni di probabilità" (ordine: p10, p25, p50, p75, p90)
+PERCENTILI_BANDE = [10, 25, 50, 75, 90]
+# Percentili calcolati e messi in cache per ogni matrice: le bande più l'80°,
+# usato da tutti i grafici per la scala dell'asse Y
+PERCENTILI_IN_CACHE = PERCENTILI_BANDE + [80]
+
+def _get_percentili_in_cache(data):
+    """
+    Calcola tutti i PERCENTILI_IN_CACHE lungo l'asse delle simulazioni in un
+    unico passaggio (vedi `fast_percentiles.col_percentiles`) e li memorizza in
+    `st.session_state`, così i grafici che usano la stessa matrice (anche in tab
+    diverse e nei rerun successivi) non ripetono il calcolo.
+
+    Args:
+        data (np.ndarray): Matrice dei dati (simulazioni x anni).
+
+    Returns:
+        np.ndarray: Matrice (len(PERCENTILI_IN_CACHE) x anni).
+    """
+    cache = st.session_state.setdefault('percentile_bands', {})
+    voce = cache.get(id(data))
+    # Conserviamo il riferimento all'array per non confondere oggetti diversi con lo stesso id
+    if voce is None or voce[0] is not data:
+        voce = (data, fast_percentiles.col_percentiles(data, PERCENTILI_IN_CACHE))
+        cache[id(data)] = voce
+    return voce[1]
+
+def precalcola_bande(risultati):
+    """
+    Azzera la cache dei percentili e la riempie subito per le matrici dei
+    grafici principali (patrimonio reale e nominale, reddito reale), così il
+    calcolo avviene una sola volta, al termine della simulazione o del
+    caricamento, e i grafici si limitano a leggerne il risultato.
+
+    Args:
+        risultati (dict): Risultati della simulazione.
+    """
+    st.session_state.percentile_bands = {}
+    for data in risultati.get('dati_grafici_principali', {}).values():
+        if isinstance(data, np.ndarray) and data.ndim == 2:
+            _get_percentili_in_cache(data)
+
+def get_percentile_bands(data):
+    """
+    Restituisce le bande percentili (10-25-50-75-90) della matrice, dalla cache
+    di sessione.
+
+    Args:
+        data (np.ndarray): Matrice dei dati (simulazioni x anni).
+
+    Returns:
+        np.ndarray: Matrice (5 x anni) con i percentili nell'ordine di PERCENTILI_BANDE.
+    """
+    return _get_percentili_in_cache(data)[:len(PERCENTILI_BANDE)]
+
+def get_percentile(data, q):
+    """
+    Restituisce un singolo percentile per colonna, riusando la cache di sessione
+    quando `q` è tra i PERCENTILI_IN_CACHE.
+
+    Args:
+        data (np.ndarray): Matrice dei dati (simulazioni x anni).
+        q (float): Percentile richiesto (0-100).
+
+    Returns:
+        np.ndarray: Vettore con il percentile per ogni anno.
+    """
+    if q in PERCENTILI_IN_CACHE:
+        return _get_percentili_in_cache(data)[PERCENTILI_IN_CACHE.index(q)]
+    return fast_percentiles.col_percentiles(data, [q])[0]
+
+def asse_eta(eta_iniziale, n_punti):
+    """
+    Restituisce l'asse X delle età (un punto per anno, a partire da
+    `eta_iniziale`). Calcolato una sola volta per sessione e condiviso da tutti
+    i grafici; l'array è in sola lettura.
+
+    Args:
+        eta_iniziale (int): Età di partenza.
+        n_punti (int): Numero di anni (punti) dell'asse.
+
+    Returns:
+        np.ndarray: Età corrispondenti a ogni anno simulato.
+    """
+    cache = st.session_state.setdefault('assi_eta', {})
+    chiave = (eta_iniziale, n_punti)
+    if chiave not in cache:
+        asse = eta_iniziale + np.arange(n_punti)
+        asse.setflags(write=False)
+        cache[chiave] = asse
+    return cache[chiave]
+
+# Numero massimo di punti per traccia inviati a Plotly quando l'alta risoluzione è disattivata
+PUNTI_MAX_GRAFICO = 120
+
+def indici_asse_temporale(n_punti, alta_risoluzione=False):
+    """
+    Restituisce gli indici dei punti temporali da disegnare, sottocampionando
+    l'asse in modo uniforme quando i punti superano PUNTI_MAX_GRAFICO.
+    L'ultimo punto viene sempre incluso, così il grafico arriva fino alla fine
+    dell'orizzonte simulato.
+
+    Args:
+        n_punti (int): Numero di punti temporali disponibili.
+        alta_risoluzione (bool): Se True, restituisce tutti i punti.
+
+    Returns:
+        np.ndarray: Indici (ordinati) dei punti da mostrare.
+    """
+    passo = 1 if alta_risoluzione else max(1, n_punti // PUNTI_MAX_GRAFICO)
+    indici = np.arange(0, n_punti, passo)
+    if n_punti > 0 and indici[-1] != n_punti - 1:
+        indici = np.append(indici, n_punti - 1)
+    return indici
+
+# Generatore casuale per la scelta delle traiettorie da mostrare: il seme fisso
+# mantiene le stesse linee tra un rerun e l'altro
+_rng = np.random.default_rng(0)
+
+# Conversioni hex -> rgb già calcolate (i colori usati nei grafici sono pochi)
+_RGB_CACHE = {}
+
+def hex_to_rgb(hex_color):
+    """
+    Converte un colore esadecimale (es. '#C00000') nella tupla (r, g, b),
+    usata per costruire i colori rgba dei riempimenti.
+
+    Args:
+        hex_color (str): Colore in formato esadecimale.
+
+    Returns:
+        tuple: Le tre componenti intere (r, g, b).
+    """
+    rgb = _RGB_CACHE.get(hex_color)
+    if rgb is None:
+        valore = hex_color.lstrip('#')
+        rgb = tuple(int(valore[i:i+2], 16) for i in (0, 2, 4))
+        _RGB_CACHE[hex_color] = rgb
+    return rgb
+
+def _arr_digest(a):
+    """
+    Impronta compatta di un array NumPy, usata come chiave di cache per i grafici
+    al posto dell'hash predefinito di Streamlit.
+
+    Args:
+        a (np.ndarray): Array da identificare.
+
+    Returns:
+        tuple: (forma, dtype, digest BLAKE2b del contenuto).
+    """
+    contenuto = np.ascontiguousarray(a)
+    return a.shape, str(a.dtype), hashlib.blake2b(contenuto.data, digest_size=16).hexdigest()
+
+def get_serie(dati_tabella, chiave, lunghezza):
+    """
+    Legge una serie dai dati dettagliati, restituendo una serie di zeri solo se
+    il campo manca. La serie di ripiego è una vista in sola lettura di un unico
+    zero (`np.broadcast_to`), quindi non alloca memoria nemmeno in quel caso.
+    I dati sono sempre un array strutturato, sia per una nuova simulazione sia
+    per quelle caricate dallo storico (vedi `_mediana_strutturata`).
+
+    Args:
+        dati_tabella (np.ndarray): Dati annuali dettagliati dello scenario mediano.
+        chiave (str): Nome della serie.
+        lunghezza (int): Lunghezza della serie di zeri di ripiego.
+
+    Returns:
+        np.ndarray: La serie richiesta.
+    """
+    if chiave in dati_tabella.dtype.names:
+        return dati_tabella[chiave]
+    return np.broadcast_to(np.float32(0), (lunghezza,))
+
+@st.cache_resource
+def indice_anni(num_anni):
+    """
+    Restituisce l'indice degli anni 1..num_anni usato dalle tabelle annuali.
+    L'array è condiviso tra i rerun (e le sessioni) ed è quindi in sola lettura.
+
+    Args:
+        num_anni (int): Numero di anni simulati.
+
+    Returns:
+        np.ndarray: Array [1, 2, ..., num_anni].
+    """
+    indice = np.arange(1, num_anni + 1)
+    indice.setflags(write=False)
+    return indice
+
+def mostra_metriche(metriche, delta_color="normal"):
+    """
+    Disegna una riga di metriche, una per colonna, a partire da una lista.
+
+    Args:
+        metriche (list): Tuple (etichetta, valore, help, delta); delta può essere None.
+        delta_color (str): Colore del delta, come in `st.metric`.
+    """
+    for colonna, (etichetta, valore, aiuto, delta) in zip(st.columns(len(metriche)), metriche):
+        colonna.metric(etichetta, valore, delta=delta, delta_color=delta_color, help=aiuto)
+
+def indici_scenari_peggiori(patrimoni_finali, quota=0.1):
+    """
+    Seleziona gli indici della quota di simulazioni con il patrimonio finale più basso.
+
+    Args:
+        patrimoni_finali (np.ndarray): Patrimonio finale di ogni simulazione.
+        quota (float): Frazione di scenari da selezionare (default 10%).
+
+    Returns:
+        np.ndarray: Indici (non ordinati) degli scenari peggiori.
+    """
+    n_worst = max(1, int(len(patrimoni_finali) * quota))
+    # Selezione parziale O(n): l'ordine interno dei peggiori non conta per i percentili
+    return np.argpartition(patrimoni_finali, n_worst - 1)[:n_worst]
+
+# Colonne della tabella annuale dettagliata: (etichetta, chiave nei dati dello scenario mediano)
+COLONNE_TABELLA_DETTAGLIO = (
+    ('Obiettivo Prelievo (Nom.)', 'prelievi_target_nominali'),
+    ('Prelievo Effettivo (Nom.)', 'prelievi_effettivi_nominali'),
+    ('Prelievo Effettivo (Reale)', 'prelievi_effettivi_reali'),
+    ('Fonte: Conto Corrente', 'prelievi_da_banca_nominali'),
+    ('Fonte: Vendita ETF', 'prelievi_da_etf_nominali'),
+    ('Vendita ETF (Rebalance)', 'vendite_rebalance_nominali'),
+    ('Pensione Pubblica (Nom.)', 'pensioni_pubbliche_nominali'),
+    ('Rendita FP (Nom.)', 'rendite_fp_nominali'),
+    ('Liquidazione FP (Nom.)', 'fp_liquidato_nominale'),
+    # Per i saldi, partiamo dall'anno 1 per allinearli con gli anni del dataframe
+    ('Patrimonio Banca (Nom.)', 'saldo_banca_nominale'),
+    ('Patrimonio ETF (Nom.)', 'saldo_etf_nominale'),
+    ('Patrimonio FP (Nom.)', 'saldo_fp_nominale'),
+    ('Patrimonio Banca (Reale)', 'saldo_banca_reale'),
+    ('Patrimonio ETF (Reale)', 'saldo_etf_reale'),
+    ('Patrimonio FP (Reale)', 'saldo_fp_reale'),
+    ('Variazione Netta Patrimonio %', 'variazione_patrimonio_percentuale'),
+    ('Rendimento Portafoglio %', 'rendimento_investimento_percentuale')
+)
+# Colonne percentuali della tabella: nel DataFrame sono già moltiplicate per 100
+COLONNE_PERCENTUALI_DETTAGLIO = ('Variazione Netta Patrimonio %', 'Rendimento Portafoglio %')
+
+def _colore_segno(colonna):
+    """
+    Stile delle colonne percentuali della tabella dettagliata: rosso per i
+    valori negativi, verde per gli altri, scelto per tutta la colonna con
+    un'unica `np.where`.
+
+    Args:
+        colonna (pd.Series): Colonna del DataFrame (passata da `Styler.apply`).
+
+    Returns:
+        np.ndarray: Lo stile CSS di ogni cella.
+    """
+    return np.where(colonna.to_numpy() < 0, 'color: red', 'color: green')
+
+@st.cache_data(show_spinner=False, hash_funcs={np.ndarray: _arr_digest})
+def _build_detail_df(dati_tabella, num_anni, eta_iniziale):
+    """
+    Costruisce il DataFrame della tabella annuale dettagliata dello scenario
+    mediano. In cache: i rerun successivi (es. cambio di tab) riusano il
+    DataFrame già pronto finché i dati non cambiano.
+
+    Args:
+        dati_tabella (np.ndarray): Dati annuali dettagliati dello scenario mediano.
+        num_anni (int): Numero di anni simulati.
+        eta_iniziale (int): Età di partenza.
+
+    Returns:
+        pd.DataFrame: Una riga per anno, colonne come in COLONNE_TABELLA_DETTAGLIO.
+    """
+    df_index = indice_anni(num_anni)
+    # I dati annuali (sia flussi che saldi) sono memorizzati negli indici da 1 a num_anni.
+    # L'indice 0 è usato solo per i saldi iniziali.
+    # Quindi, per la tabella che mostra gli anni da 1 in poi, peschiamo sempre da quell'intervallo.
+    # Tutte le colonne numeriche finiscono in un'unica matrice (anni x colonne): il
+    # DataFrame la usa come un solo blocco contiguo, senza una copia per colonna.
+    valori = np.column_stack([
+        get_serie(dati_tabella, key, num_anni + 1)[1:num_anni+1]
+        for _, key in COLONNE_TABELLA_DETTAGLIO
+    ])
+    # Le variazioni sono frazioni: in punti percentuali per il formato "%+.2f%%" della griglia
+    percentuali = [i for i, (col, _) in enumerate(COLONNE_TABELLA_DETTAGLIO) if col in COLONNE_PERCENTUALI_DETTAGLIO]
+    valori[:, percentuali] *= 100
+    df = pd.DataFrame(valori, columns=[col for col, _ in COLONNE_TABELLA_DETTAGLIO], copy=False)
+    # Tipi compatti per la serializzazione Arrow verso il browser: gli importi sono
+    # già float32 (vedi `converti_in_float32`), anni ed età stanno in un int16
+    df.insert(0, 'Età', (eta_iniziale + df_index).astype(np.int16))
+    df.insert(0, 'Anno', df_index.astype(np.int16))
+    return df
+
+def layout_linea_prelievi(eta_iniziale, anni_inizio_prelievo, etichetta_a_sinistra=False, font=None):
+    """
+    Restituisce la linea verticale tratteggiata che segna l'età di inizio dei
+    prelievi (con la sua etichetta), nello stile comune a tutti i grafici.
+    Va passata a `fig.update_layout(...)` insieme al resto del layout: è
+    equivalente a `fig.add_vline`, ma senza un ulteriore aggiornamento della figura.
+
+    Args:
+        eta_iniziale (int): Età di partenza.
+        anni_inizio_prelievo (int): Anni prima dell'inizio dei prelievi.
+        etichetta_a_sinistra (bool): Se True, l'etichetta sta a sinistra della linea.
+        font (dict, optional): Stile del testo dell'etichetta.
+
+    Returns:
+        dict: Argomenti `shapes` e `annotations` per `update_layout`.
+    """
+    x = eta_iniziale + anni_inizio_prelievo
+    linea = dict(type='line', x0=x, x1=x, xref='x', y0=0, y1=1, yref='y domain',
+                 line=dict(color='grey', dash='dash', width=2))
+    etichetta = dict(text="Inizio Prelievi", showarrow=False, x=x, xref='x', y=1, yref='y domain',
+                     xanchor='right' if etichetta_a_sinistra else 'left', yanchor='top')
+    if font is not None:
+        etichetta['font'] = font
+    return dict(shapes=[linea], annotations=[etichetta])
+
+# Le funzioni di plotting sono pure: a parità di dati e parametri la figura è la
+# stessa, quindi la si ricostruisce solo quando cambiano gli input. Con
+# cache_resource la figura in cache viene restituita senza copie: le figure
+# restituite NON vanno modificate dal chiamante (le annotazioni si aggiungono
+# all'interno delle funzioni di plotting).
+cache_grafico = st.cache_resource(max_entries=16, show_spinner=False, hash_funcs={np.ndarray: _arr_digest})
 
 # --- FUNZIONI DI PLOTTING ---
 
+@cache_grafico
 def plot_wealth_composition_chart(initial, contributions, gains):
     """
     Crea un grafico a barre che scompone la ricchezza finale mediana
@@ -111,7 +706,7 @@ def plot_wealth_composition_chart(initial, contributions, gains):
         x=labels, 
         y=values,
         marker_color=colors,
-        text=[f"€{v:,.0f}" for v in values],
+        texttemplate="€%{y:,.0f}",
         textposition='auto',
         hovertemplate='Fonte: %{x}<br>Valore: €%{y:,.0f}<extra></extra>'
     )])
@@ -125,7 +720,8 @@ def plot_wealth_composition_chart(initial, contributions, gains):
     )
     return fig
 
-def plot_wealth_summary_chart(data, title, y_title, anni_totali, eta_iniziale, anni_inizio_prelievo, color_median='#C00000', color_fill='#C00000'):
+@cache_grafico
+def plot_wealth_summary_chart(data, title, y_title, anni_totali, eta_iniziale, anni_inizio_prelievo, color_median='#C00000', color_fill='#C00000', alta_risoluzione=False):
     """
     Disegna il grafico principale a "cono di probabilità" per mostrare 
     l'evoluzione del patrimonio nel tempo, evidenziando gli intervalli di 
@@ -141,6 +737,7 @@ def plot_wealth_summary_chart(data, title, y_title, anni_totali, eta_iniziale, a
         anni_inizio_prelievo (int): Anni prima dell'inizio dei prelievi.
         color_median (str): Colore della linea mediana.
         color_fill (str): Colore base per le aree di confidenza.
+        alta_risoluzione (bool): Se False, l'asse temporale viene sottocampionato.
 
     Returns:
         go.Figure: L'oggetto grafico Plotly.
@@ -148,52 +745,55 @@ def plot_wealth_summary_chart(data, title, y_title, anni_totali, eta_iniziale, a
     fig = go.Figure()
     
     # L'asse x (anni) deve avere la stessa lunghezza dei dati
-    anni = np.arange(data.shape[1])
-    x_axis_labels = eta_iniziale + anni
+    x_axis_labels = asse_eta(eta_iniziale, data.shape[1])
 
-    p10 = np.percentile(data, 10, axis=0)
-    p25 = np.percentile(data, 25, axis=0)
-    p50 = np.median(data, axis=0)
-    p75 = np.percentile(data, 75, axis=0)
-    p90 = np.percentile(data, 90, axis=0)
+    p10, p25, p50, p75, p90 = get_percentile_bands(data)
 
-    # Funzione helper per convertire hex in rgba per il fill
-    def hex_to_rgb(hex_color):
-        hex_color = hex_color.lstrip('#')
-        return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+    # Sottocampionamento dell'asse temporale per alleggerire il grafico
+    indici = indici_asse_temporale(data.shape[1], alta_risoluzione)
+    x_axis_labels = x_axis_labels[indici]
+    p10, p25, p50, p75, p90 = p10[indici], p25[indici], p50[indici], p75[indici], p90[indici]
 
-    rgb_fill = hex_to_rgb(color_fill)
+    # Colori di riempimento delle due bande, costruiti una sola volta
+    r, g, b = hex_to_rgb(color_fill)
+    fill_10_90 = f'rgba({r}, {g}, {b}, 0.2)'
+    fill_25_75 = f'rgba({r}, {g}, {b}, 0.4)'
+
+    # Asse x "andata e ritorno" per i poligoni delle bande, condiviso da entrambe
+    x_chiuso = np.concatenate([x_axis_labels, x_axis_labels[::-1]])
 
     # Aree di confidenza
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([x_axis_labels, x_axis_labels[::-1]]),
-        y=np.concatenate([p90, p10[::-1]]),
-        fill='toself',
-        fillcolor=f'rgba({rgb_fill[0]}, {rgb_fill[1]}, {rgb_fill[2]}, 0.2)',
-        line={'color': 'rgba(255,255,255,0)'},
-        name='10-90 Percentile',
-        hoverinfo='none'
-    ))
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([x_axis_labels, x_axis_labels[::-1]]),
-        y=np.concatenate([p75, p25[::-1]]),
-        fill='toself',
-        fillcolor=f'rgba({rgb_fill[0]}, {rgb_fill[1]}, {rgb_fill[2]}, 0.4)',
-        line={'color': 'rgba(255,255,255,0)'},
-        name='25-75 Percentile',
-        hoverinfo='none'
-    ))
-
-    # Linea mediana
-    fig.add_trace(go.Scatter(
-        x=x_axis_labels, y=p50, mode='lines',
-        name='Scenario Mediano (50°)',
-        line={'width': 3, 'color': color_median},
-        hovertemplate='Età %{x:.1f}<br>Patrimonio Mediano: €%{y:,.0f}<extra></extra>'
-    ))
+    fig.add_traces([
+        go.Scattergl(
+            x=x_chiuso,
+            y=np.concatenate([p90, p10[::-1]]),
+            fill='toself',
+            fillcolor=fill_10_90,
+            line={'color': 'rgba(255,255,255,0)'},
+            name='10-90 Percentile',
+            hoverinfo='none'
+        ),
+        go.Scattergl(
+            x=x_chiuso,
+            y=np.concatenate([p75, p25[::-1]]),
+            fill='toself',
+            fillcolor=fill_25_75,
+            line={'color': 'rgba(255,255,255,0)'},
+            name='25-75 Percentile',
+            hoverinfo='none'
+        ),
+
+        # Linea mediana
+        go.Scattergl(
+            x=x_axis_labels, y=p50, mode='lines',
+            name='Scenario Mediano (50°)',
+            line={'width': 3, 'color': color_median},
+            hovertemplate='Età %{x:.1f}<br>Patrimonio Mediano: €%{y:,.0f}<extra></extra>'
+        )
+    ])
     
     # Scala Y: robusta basata sull'80° percentile per maggiore leggibilità
-    p80 = np.percentile(data, 80, axis=0)
+    p80 = get_percentile(data, 80)
     y_max = np.max(p80) * 1.05
         
     fig.update_layout(
@@ -207,27 +807,21 @@ def plot_wealth_summary_chart(data, title, y_title, anni_totali, eta_iniziale, a
             range=[0, y_max],
             tickprefix="€",
             tickformat=".2s"
-        )
-    )
-
-    fig.update_xaxes(
-        title_text="Età",
-        tickvals=np.arange(0, anni_totali + 1, 5) + eta_iniziale,
-        tickangle=45
-    )
-    
-    # Aggiungi una linea tratteggiata per l'inizio dei prelievi
-    eta_prelievo = eta_iniziale + anni_inizio_prelievo
-    fig.add_vline(x=eta_prelievo, line_width=2, line_dash="dash", line_color="grey",
-                  annotation_text="Inizio Prelievi", 
-                  annotation_position="top left",
-                  annotation_font_size=12,
-                  annotation_font_color="grey"
+        ),
+        xaxis=dict(
+            tickvals=np.arange(0, anni_totali + 1, 5) + eta_iniziale,
+            tickangle=45
+        ),
+        # Linea tratteggiata per l'inizio dei prelievi
+        **layout_linea_prelievi(eta_iniziale, anni_inizio_prelievo,
+                                etichetta_a_sinistra=True,
+                                font=dict(size=12, color="grey"))
     )
 
     return fig
 
-def plot_spaghetti_chart(data, title, y_title, anni_totali, eta_iniziale, anni_inizio_prelievo, color_median='#C00000'):
+@cache_grafico
+def plot_spaghetti_chart(data, title, y_title, anni_totali, eta_iniziale, anni_inizio_prelievo, color_median='#C00000', alta_risoluzione=False):
     """
     Crea un grafico "spaghetti", mostrando un sottoinsieme di traiettorie 
     individuali delle simulazioni per dare un'idea della variabilità dei percorsi.
@@ -241,41 +835,48 @@ def plot_spaghetti_chart(data, title, y_title, anni_totali, eta_iniziale, anni_i
         eta_iniziale (int): Età di partenza.
         anni_inizio_prelievo (int): Anni prima dei prelievi.
         color_median (str): Colore per la linea mediana.
+        alta_risoluzione (bool): Se False, l'asse temporale viene sottocampionato.
 
     Returns:
         go.Figure: L'oggetto grafico Plotly.
     """
     fig = go.Figure()
-    anni_asse_x = eta_iniziale + np.linspace(0, anni_totali, data.shape[1])
+    anni_asse_x = asse_eta(eta_iniziale, data.shape[1])
+    indici_tempo = indici_asse_temporale(data.shape[1], alta_risoluzione)
+    anni_asse_x = anni_asse_x[indici_tempo]
 
     # Mostra un sottoinsieme di simulazioni per non appesantire il grafico
     n_sim_da_mostrare = min(50, data.shape[0])
-    indici_da_mostrare = np.random.choice(data.shape[0], size=n_sim_da_mostrare, replace=False)
-
-    # Usa una palette di colori per le linee
-    color_palette = px.colors.qualitative.Plotly
-
-    for i, idx in enumerate(indici_da_mostrare):
-        fig.add_trace(go.Scatter(
-            x=anni_asse_x, y=data[idx, :], mode='lines',
-            line={'width': 1.5, 'color': color_palette[i % len(color_palette)]},
-            opacity=0.6,
+    # shuffle=False: basta estrarre k indici distinti, senza rimescolarli
+    indici_da_mostrare = _rng.choice(data.shape[0], size=n_sim_da_mostrare, replace=False, shuffle=False)
+
+    # Tutte le traiettorie in un'unica traccia WebGL: ogni riga termina con un NaN,
+    # che Plotly interpreta come interruzione della linea
+    n_punti = len(indici_tempo)
+    traiettorie = np.full((n_sim_da_mostrare, n_punti + 1), np.nan)
+    traiettorie[:, :n_punti] = data[np.ix_(indici_da_mostrare, indici_tempo)]
+    median_data = get_percentile(data, 50)[indici_tempo]
+    fig.add_traces([
+        go.Scattergl(
+            x=np.tile(np.append(anni_asse_x, np.nan), n_sim_da_mostrare),
+            y=traiettorie.ravel(),
+            mode='lines',
+            line={'width': 1, 'color': 'rgba(100,100,200,0.4)'},
             hoverinfo='none',
             showlegend=False,
-            name=f'Simulazione {i}'
-        ))
-
-    # Aggiungi la mediana in evidenza
-    median_data = np.median(data, axis=0)
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=median_data, mode='lines',
-        name='Scenario Mediano (50°)',
-        line={'width': 4, 'color': color_median},
-        hovertemplate='Età %{x:.1f}<br>Patrimonio Mediano: €%{y:,.0f}<extra></extra>'
-    ))
+            name='Simulazioni'
+        ),
+        # Mediana in evidenza
+        go.Scatter(
+            x=anni_asse_x, y=median_data, mode='lines',
+            name='Scenario Mediano (50°)',
+            line={'width': 4, 'color': color_median},
+            hovertemplate='Età %{x:.1f}<br>Patrimonio Mediano: €%{y:,.0f}<extra></extra>'
+        )
+    ])
     
     # Scala dinamica robusta basata sull'80° percentile
-    p80 = np.percentile(data, 80, axis=0)
+    p80 = get_percentile(data, 80)
     y_max = np.max(p80) * 1.05
             
     fig.update_layout(
@@ -290,12 +891,13 @@ def plot_spaghetti_chart(data, title, y_title, anni_totali, eta_iniziale, anni_i
             range=[0, y_max],
             tickprefix="€",
             tickformat=".2s"
-        )
+        ),
+        **layout_linea_prelievi(eta_iniziale, anni_inizio_prelievo)
     )
-    fig.add_vline(x=eta_iniziale + anni_inizio_prelievo, line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
     return fig
 
-def plot_income_cone_chart(data, anni_totali, anni_inizio_prelievo, eta_iniziale):
+@cache_grafico
+def plot_income_cone_chart(data, anni_totali, anni_inizio_prelievo, eta_iniziale, alta_risoluzione=False):
     """
     Crea un grafico a cono di probabilità per mostrare l'evoluzione del 
     reddito reale annuo disponibile durante la fase di prelievo.
@@ -305,51 +907,58 @@ def plot_income_cone_chart(data, anni_totali, anni_inizio_prelievo, eta_iniziale
         anni_totali (int): Durata totale della simulazione.
         anni_inizio_prelievo (int): Anni prima dei prelievi.
         eta_iniziale (int): Età di partenza.
+        alta_risoluzione (bool): Se False, l'asse temporale viene sottocampionato.
 
     Returns:
         go.Figure: L'oggetto grafico Plotly.
     """
     fig = go.Figure()
 
-    p10 = np.percentile(data, 10, axis=0)
-    p25 = np.percentile(data, 25, axis=0)
-    p50 = np.median(data, axis=0)
-    p75 = np.percentile(data, 75, axis=0)
-    p90 = np.percentile(data, 90, axis=0)
+    p10, p25, p50, p75, p90 = get_percentile_bands(data)
     
-    eta_asse_x = eta_iniziale + np.arange(data.shape[1])
+    eta_asse_x = asse_eta(eta_iniziale, data.shape[1])
+
+    # Sottocampionamento dell'asse temporale per alleggerire il grafico
+    indici = indici_asse_temporale(data.shape[1], alta_risoluzione)
+    eta_asse_x = eta_asse_x[indici]
+    p10, p25, p50, p75, p90 = p10[indici], p25[indici], p50[indici], p75[indici], p90[indici]
+
+    # Asse x "andata e ritorno" per i poligoni delle bande, condiviso da entrambe
+    x_chiuso = np.concatenate([eta_asse_x, eta_asse_x[::-1]])
 
     # Aree di confidenza
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([eta_asse_x, eta_asse_x[::-1]]),
-        y=np.concatenate([p90, p10[::-1]]),
-        fill='toself',
-        fillcolor='rgba(0, 176, 246, 0.2)', # Azzurro chiaro
-        line={'color': 'rgba(255,255,255,0)'},
-        name='10-90 Percentile',
-        hoverinfo='none'
-    ))
-
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([eta_asse_x, eta_asse_x[::-1]]),
-        y=np.concatenate([p75, p25[::-1]]),
-        fill='toself',
-        fillcolor='rgba(0, 176, 246, 0.4)', # Azzurro più scuro
-        line={'color': 'rgba(255,255,255,0)'},
-        name='25-75 Percentile',
-        hoverinfo='none'
-    ))
-
-    # Linea mediana
-    fig.add_trace(go.Scatter(
-        x=eta_asse_x, y=p50, mode='lines',
-        name='Reddito Mediano',
-        line={'width': 3, 'color': '#005c9e'}, # Blu scuro
-        hovertemplate='Età %{x}<br>Reddito Annuo: €%{y:,.0f}<extra></extra>'
-    ))
+    fig.add_traces([
+        go.Scattergl(
+            x=x_chiuso,
+            y=np.concatenate([p90, p10[::-1]]),
+            fill='toself',
+            fillcolor='rgba(0, 176, 246, 0.2)', # Azzurro chiaro
+            line={'color': 'rgba(255,255,255,0)'},
+            name='10-90 Percentile',
+            hoverinfo='none'
+        ),
+
+        go.Scattergl(
+            x=x_chiuso,
+            y=np.concatenate([p75, p25[::-1]]),
+            fill='toself',
+            fillcolor='rgba(0, 176, 246, 0.4)', # Azzurro più scuro
+            line={'color': 'rgba(255,255,255,0)'},
+            name='25-75 Percentile',
+            hoverinfo='none'
+        ),
+
+        # Linea mediana
+        go.Scattergl(
+            x=eta_asse_x, y=p50, mode='lines',
+            name='Reddito Mediano',
+            line={'width': 3, 'color': '#005c9e'}, # Blu scuro
+            hovertemplate='Età %{x}<br>Reddito Annuo: €%{y:,.0f}<extra></extra>'
+        )
+    ])
 
     # Scala dinamica robusta basata sull'80° percentile
-    p80 = np.percentile(data, 80, axis=0)
+    p80 = get_percentile(data, 80)
     y_max = np.max(p80) * 1.05
 
     fig.update_layout(
@@ -363,14 +972,14 @@ def plot_income_cone_chart(data, anni_totali, anni_inizio_prelievo, eta_iniziale
             range=[0, y_max],
             tickprefix="€",
             tickformat=".2s"
-        )
+        ),
+        **layout_linea_prelievi(eta_iniziale, anni_inizio_prelievo)
     )
 
-    fig.add_vline(x=eta_iniziale + anni_inizio_prelievo, line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
-
     return fig
 
-def plot_worst_scenarios_chart(patrimoni_finali, data, anni_totali, eta_iniziale):
+@cache_grafico
+def plot_worst_scenarios_chart(patrimoni_finali, data, anni_totali, eta_iniziale, worst_idx=None, alta_risoluzione=False):
     """
     Crea un grafico a "cono di probabilità" focalizzato esclusivamente sul 10% 
     degli scenari peggiori, per analizzare la robustezza del piano in condizioni avverse.
@@ -380,6 +989,9 @@ def plot_worst_scenarios_chart(patrimoni_finali, data, anni_totali, eta_iniziale
         data (np.ndarray): Matrice completa dei dati del patrimonio (simulazioni x mesi).
         anni_totali (int): Durata totale della simulazione.
         eta_iniziale (int): Età di partenza.
+        worst_idx (np.ndarray, optional): Indici degli scenari peggiori già
+            selezionati (vedi `indici_scenari_peggiori`); se assente vengono calcolati qui.
+        alta_risoluzione (bool): Se False, l'asse temporale viene sottocampionato.
 
     Returns:
         go.Figure: L'oggetto grafico Plotly.
@@ -387,51 +999,54 @@ def plot_worst_scenarios_chart(patrimoni_finali, data, anni_totali, eta_iniziale
     fig = go.Figure()
 
     # Trova il 10% degli scenari peggiori
-    n_worst = max(1, int(data.shape[0] * 0.1))
-    worst_indices = np.argsort(patrimoni_finali)[:n_worst]
-    worst_data = data[worst_indices, :]
+    if worst_idx is None:
+        worst_idx = indici_scenari_peggiori(patrimoni_finali)
+    # Righe degli scenari peggiori e colonne sottocampionate in un'unica selezione,
+    # così i percentili vengono calcolati solo sui punti effettivamente disegnati
+    indici_tempo = indici_asse_temporale(data.shape[1], alta_risoluzione)
+    worst_data = data[np.ix_(worst_idx, indici_tempo)]
 
     # Calcola i percentili ALL'INTERNO del gruppo dei peggiori
-    p10_worst = np.percentile(worst_data, 10, axis=0)
-    p25_worst = np.percentile(worst_data, 25, axis=0)
-    p50_worst = np.median(worst_data, axis=0)
-    p75_worst = np.percentile(worst_data, 75, axis=0)
-    p90_worst = np.percentile(worst_data, 90, axis=0)
+    # Un solo passaggio per bande e 80° percentile (scala dell'asse Y)
+    p10_worst, p25_worst, p50_worst, p75_worst, p90_worst, p80_worst = fast_percentiles.col_percentiles(worst_data, PERCENTILI_IN_CACHE)
 
-    anni_asse_x = eta_iniziale + np.linspace(0, anni_totali, data.shape[1])
+    anni_asse_x = asse_eta(eta_iniziale, data.shape[1])[indici_tempo]
+    # Asse x "andata e ritorno" per i poligoni delle bande, condiviso da entrambe
+    x_chiuso = np.concatenate([anni_asse_x, anni_asse_x[::-1]])
 
     # Area di confidenza larga (10-90)
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([anni_asse_x, anni_asse_x[::-1]]),
-        y=np.concatenate([p90_worst, p10_worst[::-1]]),
-        fill='toself',
-        fillcolor='rgba(255, 159, 64, 0.2)',  # Arancione chiaro
-        line={'color': 'rgba(255,255,255,0)'},
-        name='10-90 Percentile (Peggiori)',
-        hoverinfo='none'
-    ))
-
-    # Area di confidenza stretta (25-75)
-    fig.add_trace(go.Scatter(
-        x=np.concatenate([anni_asse_x, anni_asse_x[::-1]]),
-        y=np.concatenate([p75_worst, p25_worst[::-1]]),
-        fill='toself',
-        fillcolor='rgba(255, 159, 64, 0.4)',  # Arancione più scuro
-        line={'color': 'rgba(255,255,255,0)'},
-        name='25-75 Percentile (Peggiori)',
-        hoverinfo='none'
-    ))
-
-    # Mediana degli scenari peggiori
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=p50_worst, mode='lines',
-        name='Mediana Scenari Peggiori',
-        line={'width': 3, 'color': '#ff6347'},  # Rosso pomodoro
-        hovertemplate='Età %{x:.1f}<br>Patrimonio Mediano (Peggiori): €%{y:,.0f}<extra></extra>'
-    ))
+    fig.add_traces([
+        go.Scattergl(
+            x=x_chiuso,
+            y=np.concatenate([p90_worst, p10_worst[::-1]]),
+            fill='toself',
+            fillcolor='rgba(255, 159, 64, 0.2)',  # Arancione chiaro
+            line={'color': 'rgba(255,255,255,0)'},
+            name='10-90 Percentile (Peggiori)',
+            hoverinfo='none'
+        ),
+
+        # Area di confidenza stretta (25-75)
+        go.Scattergl(
+            x=x_chiuso,
+            y=np.concatenate([p75_worst, p25_worst[::-1]]),
+            fill='toself',
+            fillcolor='rgba(255, 159, 64, 0.4)',  # Arancione più scuro
+            line={'color': 'rgba(255,255,255,0)'},
+            name='25-75 Percentile (Peggiori)',
+            hoverinfo='none'
+        ),
+
+        # Mediana degli scenari peggiori
+        go.Scattergl(
+            x=anni_asse_x, y=p50_worst, mode='lines',
+            name='Mediana Scenari Peggiori',
+            line={'width': 3, 'color': '#ff6347'},  # Rosso pomodoro
+            hovertemplate='Età %{x:.1f}<br>Patrimonio Mediano (Peggiori): €%{y:,.0f}<extra></extra>'
+        )
+    ])
 
     # Scala dinamica robusta basata sui dati degli scenari peggiori (80° percentile)
-    p80_worst = np.percentile(worst_data, 80, axis=0)
     y_max = np.max(p80_worst) * 1.05
 
     fig.update_layout(
@@ -450,6 +1065,7 @@ def plot_worst_scenarios_chart(patrimoni_finali, data, anni_totali, eta_iniziale
 
     return fig
 
+@cache_grafico
 def plot_wealth_composition_over_time_nominal(dati_tabella, anni_totali, eta_iniziale):
     """
     Crea un grafico ad area impilata (stacked area chart) che mostra 
@@ -457,7 +1073,7 @@ def plot_wealth_composition_over_time_nominal(dati_tabella, anni_totali, eta_ini
     usando i valori nominali dello scenario mediano.
 
     Args:
-        dati_tabella (dict): Dati annuali dello scenario mediano.
+        dati_tabella (np.ndarray): Dati annuali dello scenario mediano.
         anni_totali (int): Durata totale della simulazione.
         eta_iniziale (int): Età di partenza.
 
@@ -466,40 +1082,45 @@ def plot_wealth_composition_over_time_nominal(dati_tabella, anni_totali, eta_ini
     """
     fig = go.Figure()
     
-    anni_asse_x = eta_iniziale + np.arange(anni_totali + 1)
+    anni_asse_x = asse_eta(eta_iniziale, anni_totali + 1)
     
     # Estrai i dati di composizione
-    saldo_banca = dati_tabella.get('saldo_banca_nominale', np.zeros(anni_totali + 1))
-    saldo_etf = dati_tabella.get('saldo_etf_nominale', np.zeros(anni_totali + 1))
-    saldo_fp = dati_tabella.get('saldo_fp_nominale', np.zeros(anni_totali + 1))
-    
-    # Crea il grafico a area stack con stackgroup per una logica corretta e colori migliorati
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=saldo_banca, mode='lines',
-        stackgroup='one', # Imposta lo stack group
-        name='Liquidità',
-        line={'color': '#63bdeb'}, # Azzurro
-        hovertemplate='Età %{x}<br>Liquidità: €%{y:,.0f}<extra></extra>'
-    ))
-    
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=saldo_etf, mode='lines',
-        stackgroup='one',
-        name='ETF',
-        line={'color': '#ff9933'}, # Arancione
-        hovertemplate='Età %{x}<br>ETF: €%{y:,.0f}<extra></extra>'
-    ))
+    saldo_banca = get_serie(dati_tabella, 'saldo_banca_nominale', anni_totali + 1)
+    saldo_etf = get_serie(dati_tabella, 'saldo_etf_nominale', anni_totali + 1)
+    saldo_fp = get_serie(dati_tabella, 'saldo_fp_nominale', anni_totali + 1)
     
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=saldo_fp, mode='lines',
-        stackgroup='one',
-        name='Fondo Pensione',
-        line={'color': '#8fbc8f'}, # Verde
-        hovertemplate='Età %{x}<br>Fondo Pensione: €%{y:,.0f}<extra></extra>'
-    ))
+    # Area impilata: le somme cumulative sono calcolate qui con NumPy, così
+    # Plotly.js non deve impilare le serie a ogni rendering. Il valore della
+    # singola componente resta nel tooltip tramite customdata.
+    cumulate = np.cumsum([saldo_banca, saldo_etf, saldo_fp], axis=0)
+    fig.add_traces([
+        go.Scatter(
+            x=anni_asse_x, y=cumulate[0], customdata=saldo_banca, mode='lines',
+            fill='tozeroy',
+            name='Liquidità',
+            line={'color': '#63bdeb'}, # Azzurro
+            hovertemplate='Età %{x}<br>Liquidità: €%{customdata:,.0f}<extra></extra>'
+        ),
+
+        go.Scatter(
+            x=anni_asse_x, y=cumulate[1], customdata=saldo_etf, mode='lines',
+            fill='tonexty',
+            name='ETF',
+            line={'color': '#ff9933'}, # Arancione
+            hovertemplate='Età %{x}<br>ETF: €%{customdata:,.0f}<extra></extra>'
+        ),
+
+        go.Scatter(
+            x=anni_asse_x, y=cumulate[2], customdata=saldo_fp, mode='lines',
+            fill='tonexty',
+            name='Fondo Pensione',
+            line={'color': '#8fbc8f'}, # Verde
+            hovertemplate='Età %{x}<br>Fondo Pensione: €%{customdata:,.0f}<extra></extra>'
+        )
+    ])
     
     # Per questo grafico nominale, usiamo una scala dinamica per evitare tagli
-    y_max = np.max(saldo_banca + saldo_etf + saldo_fp) * 1.05
+    y_max = cumulate[-1].max() * 1.05
 
     fig.update_layout(
         title='Composizione del Patrimonio nel Tempo (Valori Nominali)',
@@ -517,7 +1138,8 @@ def plot_wealth_composition_over_time_nominal(dati_tabella, anni_totali, eta_ini
     
     return fig
 
-def plot_individual_asset_chart(real_data, nominal_data, title, anni_totali, eta_iniziale):
+@cache_grafico
+def plot_individual_asset_chart(real_data, nominal_data, title, anni_totali, eta_iniziale, anni_inizio_prelievo=None):
     """
     Crea un grafico a linee per una singola classe di asset (es. ETF, Liquidità), 
     confrontando l'evoluzione del suo valore nominale e reale.
@@ -528,28 +1150,30 @@ def plot_individual_asset_chart(real_data, nominal_data, title, anni_totali, eta
         title (str): Titolo del grafico.
         anni_totali (int): Durata totale della simulazione.
         eta_iniziale (int): Età di partenza.
+        anni_inizio_prelievo (int, optional): Se indicato, segna l'inizio dei prelievi.
 
     Returns:
         go.Figure: L'oggetto grafico Plotly.
     """
     fig = go.Figure()
-    anni_asse_x = eta_iniziale + np.arange(anni_totali + 1)
+    anni_asse_x = asse_eta(eta_iniziale, anni_totali + 1)
     
-    # Linea Nominale
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=nominal_data, mode='lines',
-        name='Valore Nominale',
-        line={'width': 2.5, 'color': '#007bff'},
-        hovertemplate='Età %{x}<br>Nominale: €%{y:,.0f}<extra></extra>'
-    ))
-    
-    # Linea Reale
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=real_data, mode='lines',
-        name='Valore Reale (potere d\'acquisto di oggi)',
-        line={'width': 2.5, 'color': '#dc3545', 'dash': 'dash'},
-        hovertemplate='Età %{x}<br>Reale: €%{y:,.0f}<extra></extra>'
-    ))
+    fig.add_traces([
+        # Linea Nominale
+        go.Scatter(
+            x=anni_asse_x, y=nominal_data, mode='lines',
+            name='Valore Nominale',
+            line={'width': 2.5, 'color': '#007bff'},
+            hovertemplate='Età %{x}<br>Nominale: €%{y:,.0f}<extra></extra>'
+        ),
+        # Linea Reale
+        go.Scatter(
+            x=anni_asse_x, y=real_data, mode='lines',
+            name='Valore Reale (potere d\'acquisto di oggi)',
+            line={'width': 2.5, 'color': '#dc3545', 'dash': 'dash'},
+            hovertemplate='Età %{x}<br>Reale: €%{y:,.0f}<extra></extra>'
+        )
+    ])
     
     y_max = np.max(nominal_data) * 1.05
 
@@ -564,10 +1188,12 @@ def plot_individual_asset_chart(real_data, nominal_data, title, anni_totali, eta
             range=[0, y_max],
             tickprefix="€",
             tickformat=".2s"
-        )
+        ),
+        **(layout_linea_prelievi(eta_iniziale, anni_inizio_prelievo) if anni_inizio_prelievo is not None else {})
     )
     return fig
 
+@cache_grafico
 def plot_income_composition(dati_tabella, anni_totali, eta_iniziale):
     """
     Crea un grafico ad area impilata (stacked area chart) che mostra le diverse
@@ -575,7 +1201,7 @@ def plot_income_composition(dati_tabella, anni_totali, eta_iniziale):
     la fase di decumulo, basandosi sullo scenario mediano.
 
     Args:
-        dati_tabella (dict): Dati annuali dello scenario mediano.
+        dati_tabella (np.ndarray): Dati annuali dello scenario mediano.
         anni_totali (int): Durata totale della simulazione.
         eta_iniziale (int): Età di partenza.
 
@@ -584,39 +1210,42 @@ def plot_income_composition(dati_tabella, anni_totali, eta_iniziale):
     """
     fig = go.Figure()
     
-    anni_asse_x = eta_iniziale + np.arange(1, anni_totali + 1)  # Escludiamo l'anno 0
+    anni_asse_x = asse_eta(eta_iniziale, anni_totali + 1)[1:]  # Escludiamo l'anno 0
     
     # Estrai i dati di reddito usando i valori reali calcolati dall'engine
-    prelievi_reali = dati_tabella.get('prelievi_effettivi_reali', np.zeros(anni_totali))
-    pensioni_reali = dati_tabella.get('pensioni_pubbliche_reali', np.zeros(anni_totali))
-    rendite_fp_reali = dati_tabella.get('rendite_fp_reali', np.zeros(anni_totali))
-    
-    # Crea il grafico a area stack
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=prelievi_reali, mode='lines',
-        stackgroup='one', # Imposta lo stack group per un corretto stacking
-        name='Prelievi dal Patrimonio',
-        line={'color': '#dc3545'},
-        hovertemplate='Età %{x}<br>Prelievi: €%{y:,.0f}<extra></extra>'
-    ))
+    prelievi_reali = get_serie(dati_tabella, 'prelievi_effettivi_reali', anni_totali)
+    pensioni_reali = get_serie(dati_tabella, 'pensioni_pubbliche_reali', anni_totali)
+    rendite_fp_reali = get_serie(dati_tabella, 'rendite_fp_reali', anni_totali)
     
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=pensioni_reali, mode='lines',
-        stackgroup='one',
-        name='Pensione Pubblica',
-        line={'color': '#28a745'},
-        hovertemplate='Età %{x}<br>Pensione: €%{y:,.0f}<extra></extra>'
-    ))
-    
-    fig.add_trace(go.Scatter(
-        x=anni_asse_x, y=rendite_fp_reali, mode='lines',
-        stackgroup='one',
-        name='Rendita Fondo Pensione',
-        line={'color': '#ffc107'},
-        hovertemplate='Età %{x}<br>Rendita FP: €%{y:,.0f}<extra></extra>'
-    ))
+    # Area impilata con somme cumulative precalcolate (vedi grafico della composizione del patrimonio)
+    cumulate = np.cumsum([prelievi_reali, pensioni_reali, rendite_fp_reali], axis=0)
+    fig.add_traces([
+        go.Scatter(
+            x=anni_asse_x, y=cumulate[0], customdata=prelievi_reali, mode='lines',
+            fill='tozeroy',
+            name='Prelievi dal Patrimonio',
+            line={'color': '#dc3545'},
+            hovertemplate='Età %{x}<br>Prelievi: €%{customdata:,.0f}<extra></extra>'
+        ),
+
+        go.Scatter(
+            x=anni_asse_x, y=cumulate[1], customdata=pensioni_reali, mode='lines',
+            fill='tonexty',
+            name='Pensione Pubblica',
+            line={'color': '#28a745'},
+            hovertemplate='Età %{x}<br>Pensione: €%{customdata:,.0f}<extra></extra>'
+        ),
+
+        go.Scatter(
+            x=anni_asse_x, y=cumulate[2], customdata=rendite_fp_reali, mode='lines',
+            fill='tonexty',
+            name='Rendita Fondo Pensione',
+            line={'color': '#ffc107'},
+            hovertemplate='Età %{x}<br>Rendita FP: €%{customdata:,.0f}<extra></extra>'
+        )
+    ])
     
-    y_max = np.max(prelievi_reali + pensioni_reali + rendite_fp_reali) * 1.05
+    y_max = cumulate[-1].max() * 1.05
 
     fig.update_layout(
         title='Composizione del Reddito Annuo nel Tempo (Valori Reali)',
@@ -643,10 +1272,13 @@ if 'simulazione_eseguita' not in st.session_state:
     st.session_state['risultati'] = {}
     st.session_state['parametri'] = {}
 
+@st.cache_data
 def get_default_portfolio():
     """
     Restituisce un DataFrame di pandas con un portafoglio di esempio.
     Utile per inizializzare lo stato dell'applicazione.
+    Il DataFrame viene costruito una sola volta; `st.cache_data` restituisce
+    a ogni sessione una copia, che può quindi essere modificata liberamente.
     """
     return pd.DataFrame([
         {"Fondo": "Vanguard FTSE All-World UCITS ETF (USD) Accumulating", "Ticker": "VWCE", "Allocazione (%)": 90.0, "TER (%)": 0.22, "Rendimento Atteso (%)": 8.0, "Volatilità Attesa (%)": 15.0, "Categoria": "Azioni"},
@@ -656,6 +1288,24 @@ def get_default_portfolio():
         {"Fondo": "iShares Automation & Robotics UCITS ETF", "Ticker": "RBOT", "Allocazione (%)": 1.0, "TER (%)": 0.40, "Rendimento Atteso (%)": 12.0, "Volatilità Attesa (%)": 25.0, "Categoria": "Azioni"},
     ])
 
+@st.cache_data
+def _portfolio_stats(valori):
+    """
+    Calcola rendimento, volatilità e TER medi ponderati del portafoglio.
+    In cache: viene ricalcolato solo quando la tabella del portafoglio cambia.
+
+    Args:
+        valori (np.ndarray): Matrice (ETF x 4) con allocazione %, rendimento %,
+            volatilità % e TER % di ogni ETF.
+
+    Returns:
+        tuple: (rendimento medio, volatilità, TER) in forma decimale.
+    """
+    # Le celle vuote (NaN) non contribuiscono, come con la somma di pandas
+    valori = np.nan_to_num(valori.reshape(-1, 4))
+    rendimento, volatilita, ter = valori[:, 0] / 100 @ valori[:, 1:] / 100
+    return float(rendimento), float(volatilita), float(ter)
+
 # --- Inizializzazione del portfolio nello stato della sessione ---
 if 'portfolio' not in st.session_state:
     st.session_state.portfolio = get_default_portfolio()
@@ -670,28 +1320,39 @@ st.markdown("È la tua ultima occasione, se rinunci non ne avrai altre. Pillola
 st.sidebar.header("Configurazione Simulazione")
 
 # --- Sezione 1: Storico Simulazioni ---
-with st.sidebar.expander("📚 Storico Simulazioni", expanded=False):
-    saved_simulations = load_simulation_files()
-    if not saved_simulations:
-        st.caption("Nessuna simulazione salvata.")
-    else:
-        for sim in saved_simulations:
-            col1, col2, col3 = st.columns([3, 1, 1])
-            with col1:
-                st.markdown(f"**{sim}**")
-                st.caption(f"Salvata il: {datetime.fromtimestamp(os.path.getmtime(os.path.join('simulation_history', sim))).strftime('%d/%m/%Y %H:%M')}")
-            with col2:
-                if st.button(f"🗑️ Elimina", key=f"del_{sim}"):
-                    os.remove(os.path.join('simulation_history', sim))
-                    st.rerun()
-
-            with col3:
-                if st.button(f"Carica", key=f"load_{sim}"):
-                    data = load_simulation_data(sim)
-                    st.session_state.parametri = data['parameters']
-                    st.session_state.risultati = data['results']
-                    st.session_state.simulazione_eseguita = True
-                    st.rerun()
+@st.fragment
+def render_history_sidebar():
+    """
+    Mostra lo storico delle simulazioni salvate. Essendo un fragment, i suoi
+    pulsanti rieseguono solo questo blocco; il caricamento di una simulazione
+    richiede invece un rerun completo dell'app.
+    """
+    with st.expander("📚 Storico Simulazioni", expanded=False):
+        saved_simulations = load_simulation_files()
+        if not saved_simulations:
+            st.caption("Nessuna simulazione salvata.")
+        else:
+            for sim, mtime in saved_simulations:
+                col1, col2, col3 = st.columns([3, 1, 1])
+                with col1:
+                    st.markdown(f"**{sim}**")
+                    st.caption(f"Salvata il: {datetime.fromtimestamp(mtime).strftime('%d/%m/%Y %H:%M')}")
+                with col2:
+                    if st.button(f"🗑️ Elimina", key=f"del_{sim}"):
+                        delete_simulation(sim)
+                        st.rerun()
+
+                with col3:
+                    if st.button(f"Carica", key=f"load_{sim}"):
+                        data = load_simulation_data(sim)
+                        st.session_state.parametri = data['parameters']
+                        st.session_state.risultati = data['results']
+                        precalcola_bande(st.session_state.risultati)
+                        st.session_state.simulazione_eseguita = True
+                        st.rerun()
+
+with st.sidebar:
+    render_history_sidebar()
 
 # --- Sezione 2: Parametri di Base ---
 with st.sidebar.expander("1. Parametri di Base", expanded=True):
@@ -814,17 +1475,17 @@ with st.sidebar.expander("2. Costruttore di Portafoglio ETF", expanded=True):
         key="portfolio_editor"
     )
 
-    total_allocation = edited_portfolio["Allocazione (%)"].sum()
+    total_allocation = float(edited_portfolio["Allocazione (%)"].sum())
     if not np.isclose(total_allocation, 100):
         st.warning(f"L'allocazione totale è {total_allocation:.2f}%. Assicurati che sia 100%.")
     else:
         st.success("Allocazione totale: 100%.")
     st.session_state.portfolio = edited_portfolio
     
-    weights = edited_portfolio["Allocazione (%)"] / 100
-    rendimento_medio_portfolio = np.sum(weights * edited_portfolio["Rendimento Atteso (%)"]) / 100
-    volatilita_portfolio = np.sum(weights * edited_portfolio["Volatilità Attesa (%)"]) / 100
-    ter_etf_portfolio = np.sum(weights * edited_portfolio["TER (%)"]) / 100
+    colonne_statistiche = ["Allocazione (%)", "Rendimento Atteso (%)", "Volatilità Attesa (%)", "TER (%)"]
+    rendimento_medio_portfolio, volatilita_portfolio, ter_etf_portfolio = _portfolio_stats(
+        edited_portfolio[colonne_statistiche].to_numpy(dtype=np.float64)
+    )
 
     st.markdown("---")
     st.markdown("##### Parametri Calcolati dal Portafoglio:")
@@ -929,11 +1590,20 @@ with st.sidebar.expander("7. Altre Entrate"):
     pensione_pubblica_annua = st.number_input("Pensione Pubblica Annua (€)", min_value=0, step=500, value=p.get('pensione_pubblica_annua', 8400), help="L'importo annuo lordo della pensione statale (es. INPS) che prevedi di ricevere.")
     inizio_pensione_anni = st.number_input("Inizio Pensione (Anni da oggi)", min_value=0, value=p.get('inizio_pensione_anni', 40), help="Tra quanti anni inizierai a ricevere la pensione pubblica.")
 
+# --- Sezione 9: Opzioni di Visualizzazione ---
+with st.sidebar.expander("8. Opzioni di Visualizzazione"):
+    alta_risoluzione_grafici = st.checkbox(
+        "Alta risoluzione grafici",
+        value=False,
+        help=f"Se disattivo, i grafici a cono e delle traiettorie mostrano al massimo {PUNTI_MAX_GRAFICO} punti per linea: il risultato è visivamente identico ma molto più leggero da caricare."
+    )
+
 # ==============================================================================
 # BLOCCO DI ESECUZIONE DELLA SIMULAZIONE
 # ==============================================================================
 if st.sidebar.button("🚀 Esegui Simulazione", type="primary"):
-    if not np.isclose(st.session_state.portfolio["Allocazione (%)"].sum(), 100):
+    # Totale già calcolato dal costruttore di portafoglio in questo stesso rerun
+    if not np.isclose(total_allocation, 100):
         st.sidebar.error("L'allocazione del portafoglio deve essere esattamente 100% per eseguire la simulazione.")
     else:
         # Calcolo peso azionario per la combinazione pesata
@@ -969,8 +1639,10 @@ if st.sidebar.button("🚀 Esegui Simulazione", type="primary"):
 
         try:
             with st.spinner("🧠 Calcolo in corso... Il modello economico sta simulando migliaia di futuri possibili..."):
-                risultati = engine.run_full_simulation(st.session_state.parametri)
-                st.session_state.risultati = risultati
+                st.session_state.risultati = _cached_run(
+                    _congela(st.session_state.parametri), os.path.getmtime(engine.__file__)
+                )
+                precalcola_bande(st.session_state.risultati)
                 st.session_state.simulazione_eseguita = True
                 st.success("Simulazione completata con successo!")
         except Exception as e:
@@ -982,8 +1654,7 @@ if st.sidebar.button("🚀 Esegui Simulazione", type="primary"):
 
 # --- Controllo di coerenza dei risultati per forzare il ricalcolo se il codice è cambiato ---
 if 'risultati' in st.session_state:
-    if 'statistiche' not in st.session_state.risultati or \
-       'guadagni_accumulo_mediano_nominale' not in st.session_state.risultati['statistiche']:
+    if 'guadagni_accumulo_mediano_nominale' not in (stats_aggregate := st.session_state.risultati.get('statistiche', {})):
         del st.session_state.risultati
         st.warning("⚠️ clicca di nuovo su 'Avvia Simulazione' per ricalcolare i risultati con la nuova logica.")
         st.stop()
@@ -1018,7 +1689,14 @@ if not st.session_state.get('simulazione_eseguita', False) or 'risultati' not in
 # per garantire la massima coerenza informativa in tutta la dashboard.
 
 dati_mediana = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
-stats_aggregate = st.session_state.risultati['statistiche']
+# stats_aggregate è già stato letto nel controllo di coerenza dei risultati: qui gli
+# scalari NumPy diventano float Python, più rapidi da formattare nelle metriche
+stats_aggregate = {
+    k: (float(v) if isinstance(v, (np.floating, np.integer)) else v)
+    for k, v in stats_aggregate.items()
+}
+# Formattazione in euro delle metriche (stessa specifica per tutti i valori)
+eur = "€ {:,.0f}".format
 
 # 1. Calcolo Componenti del Patrimonio
 patrimonio_iniziale_totale = st.session_state.parametri['capitale_iniziale'] + st.session_state.parametri['etf_iniziale']
@@ -1046,80 +1724,94 @@ contributi_versati = contributi_conto_totali + contributi_etf_totali + contribut
 
 # Guadagni da investimento (dalla simulazione)
 guadagni_da_investimento = stats_aggregate['guadagni_accumulo_mediano_nominale']
+contributi_versati = float(contributi_versati)
+# Rendimento dei guadagni rispetto ai contributi, calcolato una volta per la metrica
+delta_guadagni_contributi = f"{safe_div(guadagni_da_investimento, contributi_versati) * 100:,.0f}% vs Contributi"
 
-# Calcolo percentili patrimonio all'inizio prelievi
+# Calcolo percentili patrimonio all'inizio prelievi: colonna dei percentili
+# già calcolati per i coni di probabilità (nessun nuovo passaggio sui dati)
 idx_inizio_prelievo = st.session_state.parametri['anni_inizio_prelievo']
-patrimoni_nominali = st.session_state.risultati['dati_grafici_principali']['nominale'][:, idx_inizio_prelievo]
-patrimoni_reali = st.session_state.risultati['dati_grafici_principali']['reale'][:, idx_inizio_prelievo]
-patrimonio_inizio_prelievi_top_10_nominale = np.percentile(patrimoni_nominali, 90)
-patrimonio_inizio_prelievi_peggior_10_nominale = np.percentile(patrimoni_nominali, 10)
-patrimonio_inizio_prelievi_top_10_reale = np.percentile(patrimoni_reali, 90)
-patrimonio_inizio_prelievi_peggior_10_reale = np.percentile(patrimoni_reali, 10)
+patrimoni_nominali = st.session_state.risultati['dati_grafici_principali']['nominale']
+patrimoni_reali = st.session_state.risultati['dati_grafici_principali']['reale']
+patrimonio_inizio_prelievi_top_10_nominale = get_percentile(patrimoni_nominali, 90)[idx_inizio_prelievo]
+patrimonio_inizio_prelievi_peggior_10_nominale = get_percentile(patrimoni_nominali, 10)[idx_inizio_prelievo]
+patrimonio_inizio_prelievi_top_10_reale = get_percentile(patrimoni_reali, 90)[idx_inizio_prelievo]
+patrimonio_inizio_prelievi_peggior_10_reale = get_percentile(patrimoni_reali, 10)[idx_inizio_prelievo]
 
 # 2. Calcolo Entrate Medie Annue (dallo scenario mediano)
-# Reali
-anni_prelievo_effettivi_reali = np.where(dati_mediana['prelievi_effettivi_reali'] > 0)[0]
-prelievo_medio_reale = np.mean(dati_mediana['prelievi_effettivi_reali'][anni_prelievo_effettivi_reali]) if anni_prelievo_effettivi_reali.size > 0 else 0
+# Media dei soli anni con importo positivo, per tutti i flussi in un'unica riduzione
+flussi = np.stack([
+    dati_mediana['prelievi_effettivi_reali'], dati_mediana['rendite_fp_reali'],
+    dati_mediana['prelievi_effettivi_nominali'], dati_mediana['rendite_fp_nominali'],
+])
+anni_positivi = flussi > 0
+conteggi = np.count_nonzero(anni_positivi, axis=1)
+# La somma con maschera (where=) non crea la matrice temporanea dei valori filtrati
+somme = flussi.sum(axis=1, where=anni_positivi)
+medie_flussi = np.divide(somme, conteggi, out=np.zeros(len(flussi)), where=conteggi > 0)
+prelievo_medio_reale, rendita_fp_media_reale, prelievo_medio_nominale, rendita_fp_media_nominale = medie_flussi
 
+# Reali
 # Calcolo pensione pubblica: solo negli anni in cui viene effettivamente erogata
 inizio_pensione_anni = st.session_state.parametri.get('inizio_pensione_anni', 40)
 anni_totali = st.session_state.parametri['anni_totali']
-anni_pensione_effettivi = np.arange(inizio_pensione_anni, anni_totali + 1)
-pensione_media_reale = np.mean(dati_mediana['pensioni_pubbliche_reali'][anni_pensione_effettivi]) if anni_pensione_effettivi.size > 0 else 0
+# Anni di pensione come slice (vista) invece di un array di indici
+anni_pensione_effettivi = slice(inizio_pensione_anni, anni_totali + 1)
+n_anni_pensione = max(0, anni_totali + 1 - inizio_pensione_anni)
+pensione_media_reale = np.mean(dati_mediana['pensioni_pubbliche_reali'][anni_pensione_effettivi]) if n_anni_pensione > 0 else 0
 
-anni_rendita_fp_effettivi_reali = np.where(dati_mediana['rendite_fp_reali'] > 0)[0]
-rendita_fp_media_reale = np.mean(dati_mediana['rendite_fp_reali'][anni_rendita_fp_effettivi_reali]) if anni_rendita_fp_effettivi_reali.size > 0 else 0
 reddito_annuo_reale_pensione = prelievo_medio_reale + pensione_media_reale + rendita_fp_media_reale
 
 # Nominali
-anni_prelievo_effettivi_nominali = np.where(dati_mediana['prelievi_effettivi_nominali'] > 0)[0]
-prelievo_medio_nominale = np.mean(dati_mediana['prelievi_effettivi_nominali'][anni_prelievo_effettivi_nominali]) if anni_prelievo_effettivi_nominali.size > 0 else 0
-
 # Calcolo pensione pubblica nominale: solo negli anni in cui viene effettivamente erogata
-pensione_media_nominale = np.mean(dati_mediana['pensioni_pubbliche_nominali'][anni_pensione_effettivi]) if anni_pensione_effettivi.size > 0 else 0
+pensione_media_nominale = np.mean(dati_mediana['pensioni_pubbliche_nominali'][anni_pensione_effettivi]) if n_anni_pensione > 0 else 0
 
-anni_rendita_fp_effettivi_nominali = np.where(dati_mediana['rendite_fp_nominali'] > 0)[0]
-rendita_fp_media_nominale = np.mean(dati_mediana['rendite_fp_nominali'][anni_rendita_fp_effettivi_nominali]) if anni_rendita_fp_effettivi_nominali.size > 0 else 0
 totale_medio_nominale = prelievo_medio_nominale + pensione_media_nominale + rendita_fp_media_nominale
 
 # 3. Calcolo "Anni di Spesa" (basato sui dati mediani, ora coerente)
 patrimonio_finale_reale = stats_aggregate['patrimonio_finale_mediano_reale']
-anni_di_spesa_coperti = patrimonio_finale_reale / reddito_annuo_reale_pensione if reddito_annuo_reale_pensione > 0 else 0
+anni_di_spesa_coperti = safe_div(patrimonio_finale_reale, reddito_annuo_reale_pensione)
 
 # --- FINE BLOCCO DI CALCOLO UNIFICATO ---
 
 # Calcolo valori per liquidazione fondo pensione (fix variabile non definita)
-fp_liquidato_reale = np.sum(dati_mediana.get('fp_liquidato_reale', np.zeros_like(dati_mediana['saldo_banca_nominale'])))
-fp_liquidato_nominale = np.sum(dati_mediana.get('fp_liquidato_nominale', np.zeros_like(dati_mediana['saldo_banca_nominale'])))
+fp_liquidato_reale = np.sum(get_serie(dati_mediana, 'fp_liquidato_reale', 1))
+fp_liquidato_nominale = np.sum(get_serie(dati_mediana, 'fp_liquidato_nominale', 1))
 
 # --- Visualizzazione KPI Principali ---
 st.markdown("##### Il Tuo Percorso Finanziario in Numeri")
-col1, col2, col3, col4 = st.columns(4)
-col1.metric(
-    "Patrimonio Iniziale", f"€ {patrimonio_iniziale_totale:,.0f}",
-    help="La somma del capitale che hai all'inizio della simulazione."
-)
-col2.metric(
-    "Contributi Totali Versati", f"€ {contributi_versati:,.0f}",
-    help="La stima di tutto il denaro che verserai di tasca tua durante la fase di accumulo. Include: accantonamenti sul conto corrente ({} anni), investimenti in ETF ({} anni), e contributi al fondo pensione ({} anni se attivo). Questo è il tuo sacrificio finanziario totale, escludendo il capitale iniziale.".format(
-        anni_inizio_prelievo, 
-        anni_inizio_prelievo, 
-        min(eta_ritiro_fp - eta_iniziale, anni_totali) if attiva_fp else 0
-    )
-)
-col3.metric(
-    "Guadagni da Investimento", f"€ {guadagni_da_investimento:,.0f}",
-    delta=f"{((guadagni_da_investimento / contributi_versati) * 100) if contributi_versati > 0 else 0:,.0f}% vs Contributi",
-    help="La ricchezza generata dai soli rendimenti di mercato (interessi composti), al netto dei costi, fino all'inizio della pensione. Include: rendimenti degli ETF, rendimenti del fondo pensione, e crescita degli accantonamenti liquidi. È il premio per la tua pazienza e per il rischio che ti sei assunto."
-)
-col4.metric(
-    "Patrimonio Finale in Anni di Spesa", f"{anni_di_spesa_coperti:,.1f} Anni",
-    help=f"Il tuo patrimonio finale reale mediano, tradotto in quanti anni del tuo tenore di vita pensionistico (€{reddito_annuo_reale_pensione:,.0f}/anno) può coprire. Un valore alto indica una maggiore sicurezza."
-)
+# Metriche come (etichetta, valore, help, delta), disegnate in un'unica riga di colonne
+metriche_percorso = [
+    (
+        "Patrimonio Iniziale", eur(patrimonio_iniziale_totale),
+        "La somma del capitale che hai all'inizio della simulazione.",
+        None
+    ),
+    (
+        "Contributi Totali Versati", eur(contributi_versati),
+        "La stima di tutto il denaro che verserai di tasca tua durante la fase di accumulo. Include: accantonamenti sul conto corrente ({} anni), investimenti in ETF ({} anni), e contributi al fondo pensione ({} anni se attivo). Questo è il tuo sacrificio finanziario totale, escludendo il capitale iniziale.".format(
+            anni_inizio_prelievo,
+            anni_inizio_prelievo,
+            min(eta_ritiro_fp - eta_iniziale, anni_totali) if attiva_fp else 0
+        ),
+        None
+    ),
+    (
+        "Guadagni da Investimento", eur(guadagni_da_investimento),
+        "La ricchezza generata dai soli rendimenti di mercato (interessi composti), al netto dei costi, fino all'inizio della pensione. Include: rendimenti degli ETF, rendimenti del fondo pensione, e crescita degli accantonamenti liquidi. È il premio per la tua pazienza e per il rischio che ti sei assunto.",
+        delta_guadagni_contributi
+    ),
+    (
+        "Patrimonio Finale in Anni di Spesa", f"{anni_di_spesa_coperti:,.1f} Anni",
+        f"Il tuo patrimonio finale reale mediano, tradotto in quanti anni del tuo tenore di vita pensionistico (€{reddito_annuo_reale_pensione:,.0f}/anno) può coprire. Un valore alto indica una maggiore sicurezza.",
+        None
+    ),
+]
+mostra_metriche(metriche_percorso)
 
 # --- Performance Media per Fase ---
 st.subheader("Performance Media per Fase (Scenario Mediano)")
-variazioni_annue = np.array(dati_mediana.get('variazione_patrimonio_percentuale', [0]))
+variazioni_annue = get_serie(dati_mediana, 'variazione_patrimonio_percentuale', 1)
 idx_inizio_prelievo = st.session_state.parametri['anni_inizio_prelievo']
 variazioni_valide = variazioni_annue[:st.session_state.parametri['anni_totali']]
 variazioni_accumulo = variazioni_valide[:idx_inizio_prelievo]
@@ -1128,21 +1820,18 @@ media_accumulo = np.mean(variazioni_accumulo) if variazioni_accumulo.size > 0 el
 media_prelievo = np.mean(variazioni_prelievo) if variazioni_prelievo.size > 0 else 0
 anni_prelievo = st.session_state.parametri['anni_totali'] - idx_inizio_prelievo
 
-col1, col2 = st.columns(2)
-with col1:
-    st.metric(
-        label="Crescita Media (Accumulo)", 
-        value=f"{media_accumulo:+.2%}",
-        delta_color="normal",
-        help=f"La crescita percentuale media annua del patrimonio durante i primi {idx_inizio_prelievo} anni (fase di accumulo)."
-    )
-with col2:
-    st.metric(
-        label="Crescita Media (Prelievo)", 
-        value=f"{media_prelievo:+.2%}",
-        delta_color="normal",
-        help=f"La variazione percentuale media annua del patrimonio durante gli ultimi {anni_prelievo} anni (fase di prelievo). È normale che sia negativa, poiché i prelievi superano i rendimenti."
-    )
+mostra_metriche([
+    (
+        "Crescita Media (Accumulo)", f"{media_accumulo:+.2%}",
+        f"La crescita percentuale media annua del patrimonio durante i primi {idx_inizio_prelievo} anni (fase di accumulo).",
+        None
+    ),
+    (
+        "Crescita Media (Prelievo)", f"{media_prelievo:+.2%}",
+        f"La variazione percentuale media annua del patrimonio durante gli ultimi {anni_prelievo} anni (fase di prelievo). È normale che sia negativa, poiché i prelievi superano i rendimenti.",
+        None
+    ),
+])
 
 
 # --- Messaggi Informativi Contestuali ---
@@ -1174,21 +1863,21 @@ st.markdown("Un confronto diretto tra i valori **Nominali** (la cifra assoluta c
 col1, col2 = st.columns(2)
 with col1:
     st.subheader("Valori Nominali")
-    st.metric("Patrimonio all'Inizio Prelievi (50°)", f"€ {st.session_state.risultati['statistiche']['patrimonio_inizio_prelievi_mediano_nominale']:,.0f}", help="Il valore nominale del tuo patrimonio nel momento in cui inizi a prelevare (passaggio da accumulo a decumulo).")
-    st.metric("Patrimonio all'Inizio Prelievi (Top 10%)", f"€ {patrimonio_inizio_prelievi_top_10_nominale:,.0f}", help="Il valore nominale del patrimonio all'inizio prelievi nello scenario migliore (top 10%).")
-    st.metric("Patrimonio all'Inizio Prelievi (Peggior 10%)", f"€ {patrimonio_inizio_prelievi_peggior_10_nominale:,.0f}", help="Il valore nominale del patrimonio all'inizio prelievi nello scenario peggiore (peggior 10%).")
-    st.metric("Patrimonio Finale Mediano (50°)", f"€ {st.session_state.risultati['statistiche']['patrimonio_finale_mediano_nominale']:,.0f}", help="Il valore nominale (non aggiustato per l'inflazione) del tuo patrimonio alla fine della simulazione nello scenario mediano.")
-    st.metric("Patrimonio Finale (Top 10%)", f"€ {st.session_state.risultati['statistiche']['patrimonio_finale_top_10_nominale']:,.0f}", help="Il tuo patrimonio finale nominale in uno scenario molto fortunato (migliore del 90% delle simulazioni).")
-    st.metric("Patrimonio Finale (Peggior 10%)", f"€ {st.session_state.risultati['statistiche']['patrimonio_finale_peggior_10_nominale']:,.0f}", help="Il tuo patrimonio finale nominale in uno scenario molto sfortunato (peggiore del 90% delle simulazioni).")
+    st.metric("Patrimonio all'Inizio Prelievi (50°)", eur(stats_aggregate['patrimonio_inizio_prelievi_mediano_nominale']), help="Il valore nominale del tuo patrimonio nel momento in cui inizi a prelevare (passaggio da accumulo a decumulo).")
+    st.metric("Patrimonio all'Inizio Prelievi (Top 10%)", eur(patrimonio_inizio_prelievi_top_10_nominale), help="Il valore nominale del patrimonio all'inizio prelievi nello scenario migliore (top 10%).")
+    st.metric("Patrimonio all'Inizio Prelievi (Peggior 10%)", eur(patrimonio_inizio_prelievi_peggior_10_nominale), help="Il valore nominale del patrimonio all'inizio prelievi nello scenario peggiore (peggior 10%).")
+    st.metric("Patrimonio Finale Mediano (50°)", eur(stats_aggregate['patrimonio_finale_mediano_nominale']), help="Il valore nominale (non aggiustato per l'inflazione) del tuo patrimonio alla fine della simulazione nello scenario mediano.")
+    st.metric("Patrimonio Finale (Top 10%)", eur(stats_aggregate['patrimonio_finale_top_10_nominale']), help="Il tuo patrimonio finale nominale in uno scenario molto fortunato (migliore del 90% delle simulazioni).")
+    st.metric("Patrimonio Finale (Peggior 10%)", eur(stats_aggregate['patrimonio_finale_peggior_10_nominale']), help="Il tuo patrimonio finale nominale in uno scenario molto sfortunato (peggiore del 90% delle simulazioni).")
 
 with col2:
     st.subheader("Valori Reali")
-    st.metric("Patrimonio all'Inizio Prelievi (50°)", f"€ {st.session_state.risultati['statistiche']['patrimonio_inizio_prelievi_mediano_reale']:,.0f}", help="Il potere d'acquisto del tuo patrimonio nel momento in cui inizi a prelevare. Questo è il 'tesoretto' che hai accumulato per la pensione.")
-    st.metric("Patrimonio all'Inizio Prelievi (Top 10%)", f"€ {patrimonio_inizio_prelievi_top_10_reale:,.0f}", help="Il potere d'acquisto del patrimonio all'inizio prelievi nello scenario migliore (top 10%).")
-    st.metric("Patrimonio all'Inizio Prelievi (Peggior 10%)", f"€ {patrimonio_inizio_prelievi_peggior_10_reale:,.0f}", help="Il potere d'acquisto del patrimonio all'inizio prelievi nello scenario peggiore (peggior 10%).")
-    st.metric("Patrimonio Reale Finale Mediano (50°)", f"€ {st.session_state.risultati['statistiche']['patrimonio_finale_mediano_reale']:,.0f}", help="Il POTERE D'ACQUISTO reale del tuo patrimonio finale nello scenario mediano. Questo è il valore che conta davvero, perché tiene conto dell'inflazione.")
-    st.metric("Patrimonio Reale Finale (Top 10%)", f"€ {st.session_state.risultati['statistiche']['patrimonio_finale_top_10_reale']:,.0f}", help="Il potere d'acquisto del tuo patrimonio finale in uno scenario molto fortunato.")
-    st.metric("Patrimonio Reale Finale (Peggior 10%)", f"€ {st.session_state.risultati['statistiche']['patrimonio_finale_peggior_10_reale']:,.0f}", help="Il potere d'acquisto del tuo patrimonio finale in uno scenario molto sfortunato.")
+    st.metric("Patrimonio all'Inizio Prelievi (50°)", eur(stats_aggregate['patrimonio_inizio_prelievi_mediano_reale']), help="Il potere d'acquisto del tuo patrimonio nel momento in cui inizi a prelevare. Questo è il 'tesoretto' che hai accumulato per la pensione.")
+    st.metric("Patrimonio all'Inizio Prelievi (Top 10%)", eur(patrimonio_inizio_prelievi_top_10_reale), help="Il potere d'acquisto del patrimonio all'inizio prelievi nello scenario migliore (top 10%).")
+    st.metric("Patrimonio all'Inizio Prelievi (Peggior 10%)", eur(patrimonio_inizio_prelievi_peggior_10_reale), help="Il potere d'acquisto del patrimonio all'inizio prelievi nello scenario peggiore (peggior 10%).")
+    st.metric("Patrimonio Reale Finale Mediano (50°)", eur(stats_aggregate['patrimonio_finale_mediano_reale']), help="Il POTERE D'ACQUISTO reale del tuo patrimonio finale nello scenario mediano. Questo è il valore che conta davvero, perché tiene conto dell'inflazione.")
+    st.metric("Patrimonio Reale Finale (Top 10%)", eur(stats_aggregate['patrimonio_finale_top_10_reale']), help="Il potere d'acquisto del tuo patrimonio finale in uno scenario molto fortunato.")
+    st.metric("Patrimonio Reale Finale (Peggior 10%)", eur(stats_aggregate['patrimonio_finale_peggior_10_reale']), help="Il potere d'acquisto del tuo patrimonio finale in uno scenario molto sfortunato.")
 
 st.markdown("---")
 st.subheader("Indicatori di Rischio del Piano")
@@ -1207,19 +1896,19 @@ col1, col2 = st.columns(2)
   
 with col1:
     st.subheader("Valori Reali")
-    st.metric("Prelievo Medio dal Patrimonio", f"€ {prelievo_medio_reale:,.0f}", help="La cifra media annua, al netto dell'inflazione, che preleverai dal tuo patrimonio per sostenere il tuo tenore di vita.")
-    st.metric("Pensione Pubblica Annua", f"€ {pensione_media_reale:,.0f}", help="La stima della tua pensione statale annua, al netto dell'inflazione.")
-    st.metric("Rendita Media da FP", f"€ {rendita_fp_media_reale:,.0f}", help="La cifra media annua, al netto dell'inflazione, che riceverai dal tuo fondo pensione.")
-    st.metric("TOTALE ENTRATE MEDIE ANNUE", f"€ {reddito_annuo_reale_pensione:,.0f}", help="La somma di tutte le tue entrate annue medie, al netto dell'inflazione. Questo è il tuo potere d'acquisto reale in pensione.")
+    st.metric("Prelievo Medio dal Patrimonio", eur(prelievo_medio_reale), help="La cifra media annua, al netto dell'inflazione, che preleverai dal tuo patrimonio per sostenere il tuo tenore di vita.")
+    st.metric("Pensione Pubblica Annua", eur(pensione_media_reale), help="La stima della tua pensione statale annua, al netto dell'inflazione.")
+    st.metric("Rendita Media da FP", eur(rendita_fp_media_reale), help="La cifra media annua, al netto dell'inflazione, che riceverai dal tuo fondo pensione.")
+    st.metric("TOTALE ENTRATE MEDIE ANNUE", eur(reddito_annuo_reale_pensione), help="La somma di tutte le tue entrate annue medie, al netto dell'inflazione. Questo è il tuo potere d'acquisto reale in pensione.")
 
 with col2:
     st.subheader("Valori Nominali")
-    st.metric("Prelievo Medio dal Patrimonio (Nominale)", f"€ {prelievo_medio_nominale:,.0f}", help="La cifra media annua nominale che preleverai dal tuo patrimonio. Questo valore non tiene conto dell'inflazione.")
-    st.metric("Pensione Pubblica Annua (Nominale)", f"€ {pensione_media_nominale:,.0f}", help="La stima della tua pensione statale annua nominale. Questo valore non tiene conto dell'inflazione.")
-    st.metric("Rendita Media da FP (Nominale)", f"€ {rendita_fp_media_nominale:,.0f}", help="La cifra media annua nominale che riceverai dal tuo fondo pensione. Questo valore non tiene conto dell'inflazione.")
-    st.metric("Liquidazione Fondo Pensione (una tantum, Nominale)", f"€ {fp_liquidato_nominale:,.0f}", help="La quota del fondo pensione liquidata in capitale all'inizio della pensione, in valori nominali.")
-    st.metric("Liquidazione Fondo Pensione (una tantum, Reale)", f"€ {fp_liquidato_reale:,.0f}", help="La quota del fondo pensione liquidata in capitale all'inizio della pensione, in potere d'acquisto reale.")
-    st.metric("TOTALE ENTRATE MEDIE ANNUE (Nominale)", f"€ {totale_medio_nominale:,.0f}", help="La somma di tutte le tue entrate annue medie nominali. Questo valore non tiene conto dell'inflazione.")
+    st.metric("Prelievo Medio dal Patrimonio (Nominale)", eur(prelievo_medio_nominale), help="La cifra media annua nominale che preleverai dal tuo patrimonio. Questo valore non tiene conto dell'inflazione.")
+    st.metric("Pensione Pubblica Annua (Nominale)", eur(pensione_media_nominale), help="La stima della tua pensione statale annua nominale. Questo valore non tiene conto dell'inflazione.")
+    st.metric("Rendita Media da FP (Nominale)", eur(rendita_fp_media_nominale), help="La cifra media annua nominale che riceverai dal tuo fondo pensione. Questo valore non tiene conto dell'inflazione.")
+    st.metric("Liquidazione Fondo Pensione (una tantum, Nominale)", eur(fp_liquidato_nominale), help="La quota del fondo pensione liquidata in capitale all'inizio della pensione, in valori nominali.")
+    st.metric("Liquidazione Fondo Pensione (una tantum, Reale)", eur(fp_liquidato_reale), help="La quota del fondo pensione liquidata in capitale all'inizio della pensione, in potere d'acquisto reale.")
+    st.metric("TOTALE ENTRATE MEDIE ANNUE (Nominale)", eur(totale_medio_nominale), help="La somma di tutte le tue entrate annue medie nominali. Questo valore non tiene conto dell'inflazione.")
 
 
 
@@ -1246,132 +1935,172 @@ with st.expander("🔍 Guida alla Lettura: Perché il mio piano ha successo (o f
     """)
 
 st.header("Analisi Dettagliata per Fasi")
+# Esecuzione "pigra" delle tab: il cambio di tab provoca un rerun e viene
+# costruito solo il contenuto della tab aperta (`tab.open`), invece di tutti
+# i grafici a ogni interazione. Le figure restano in cache (`cache_grafico`),
+# quindi tornare su una tab già vista è immediato.
 tabs = st.tabs([
     "📊 Patrimonio Totale (Reale)", 
     "📈 Composizione del Patrimonio", 
     "🏖️ Analisi dei Redditi", 
     "🔥 Analisi del Rischio", 
     "🧾 Dettaglio Flussi (Mediano)"
-])
+], key="tab_analisi_dettagliata", on_change="rerun")
 
 with tabs[0]: # Patrimonio Totale
-    st.subheader("Evoluzione del Potere d'Acquisto (Patrimonio Reale)")
-    st.markdown("""
-    Questo primo grafico ti dà una visione d'insieme, un "**cono di probabilità**" del tuo **patrimonio reale**. Mostra l'intera gamma di risultati possibili, al netto dell'inflazione.
-    - **La linea rossa (Mediana):** È lo scenario più probabile.
-    - **Le aree colorate:** Rappresentano gli intervalli di confidenza. L'area più scura (25°-75°) è la fascia più probabile.
+    if tabs[0].open:
+        st.subheader("Evoluzione del Potere d'Acquisto (Patrimonio Reale)")
+        st.markdown("""
+        Questo primo grafico ti dà una visione d'insieme, un "**cono di probabilità**" del tuo **patrimonio reale**. Mostra l'intera gamma di risultati possibili, al netto dell'inflazione.
+        - **La linea rossa (Mediana):** È lo scenario più probabile.
+        - **Le aree colorate:** Rappresentano gli intervalli di confidenza. L'area più scura (25°-75°) è la fascia più probabile.
     
-    **Nota:** Se vedi un calo di questo grafico in concomitanza con il ritiro dal Fondo Pensione, non spaventarti! Vai nella tab "Composizione del Patrimonio" per capire perché: il capitale si è solo trasformato in liquidità e reddito.
-    """)
-    fig_reale = plot_wealth_summary_chart(
-        data=st.session_state.risultati['dati_grafici_principali']['reale'], 
-        title='Evoluzione Patrimonio Reale (Tutti gli Scenari)', 
-        y_title='Patrimonio Reale (€)', 
-        anni_totali=st.session_state.parametri['anni_totali'],
-        eta_iniziale=st.session_state.parametri['eta_iniziale'],
-        anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo']
-    )
-    fig_reale.add_vline(x=st.session_state.parametri['eta_iniziale'] + st.session_state.parametri['anni_inizio_prelievo'], line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
-    st.plotly_chart(fig_reale, use_container_width=True)
+        **Nota:** Se vedi un calo di questo grafico in concomitanza con il ritiro dal Fondo Pensione, non spaventarti! Vai nella tab "Composizione del Patrimonio" per capire perché: il capitale si è solo trasformato in liquidità e reddito.
+        """)
+        fig_reale = plot_wealth_summary_chart(
+            data=st.session_state.risultati['dati_grafici_principali']['reale'], 
+            title='Evoluzione Patrimonio Reale (Tutti gli Scenari)', 
+            y_title='Patrimonio Reale (€)', 
+            anni_totali=st.session_state.parametri['anni_totali'],
+            eta_iniziale=st.session_state.parametri['eta_iniziale'],
+            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo'],
+            alta_risoluzione=alta_risoluzione_grafici
+        )
+        st.plotly_chart(fig_reale, use_container_width=True)
 
-    st.markdown("---")
-    st.subheader("Evoluzione Patrimonio Nominale (Valori Assoluti)")
-    st.markdown("Questo grafico mostra l'evoluzione del patrimonio in **valori nominali**. È utile per vedere la crescita assoluta del capitale, ma ricorda che questi valori non riflettono il vero potere d'acquisto futuro.")
-    fig_nominale = plot_wealth_summary_chart(
-        data=st.session_state.risultati['dati_grafici_principali']['nominale'], 
-        title='Evoluzione Patrimonio Nominale (Tutti gli Scenari)', 
-        y_title='Patrimonio Nominale (€)', 
-        anni_totali=st.session_state.parametri['anni_totali'],
-        eta_iniziale=st.session_state.parametri['eta_iniziale'],
-        anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo'],
-        color_median='#007bff',
-        color_fill='#007bff'
-    )
-    fig_nominale.add_vline(x=st.session_state.parametri['eta_iniziale'] + st.session_state.parametri['anni_inizio_prelievo'], line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
-    st.plotly_chart(fig_nominale, use_container_width=True)
+        st.markdown("---")
+        st.subheader("Evoluzione Patrimonio Nominale (Valori Assoluti)")
+        st.markdown("Questo grafico mostra l'evoluzione del patrimonio in **valori nominali**. È utile per vedere la crescita assoluta del capitale, ma ricorda che questi valori non riflettono il vero potere d'acquisto futuro.")
+        fig_nominale = plot_wealth_summary_chart(
+            data=st.session_state.risultati['dati_grafici_principali']['nominale'], 
+            title='Evoluzione Patrimonio Nominale (Tutti gli Scenari)', 
+            y_title='Patrimonio Nominale (€)', 
+            anni_totali=st.session_state.parametri['anni_totali'],
+            eta_iniziale=st.session_state.parametri['eta_iniziale'],
+            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo'],
+            color_median='#007bff',
+            color_fill='#007bff',
+            alta_risoluzione=alta_risoluzione_grafici
+        )
+        st.plotly_chart(fig_nominale, use_container_width=True)
 
 
 with tabs[1]: # Composizione del Patrimonio
-    dati_tabella = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
+    if tabs[1].open:
+        dati_tabella = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
         
-    st.subheader("Analisi Dettagliata per Classe di Asset (Scenario Mediano)")
-    st.markdown("""
-    Qui analizziamo separatamente le tre componenti principali del tuo patrimonio. Ogni grafico mostra sia il **valore nominale** (la cifra assoluta) sia il **valore reale** (il potere d'acquisto odierno, tenendo conto dell'inflazione). Questo ti permette di vedere la crescita di ogni asset e l'impatto di eventi come la liquidazione del fondo pensione sulla liquidità.
-    """)
+        st.subheader("Analisi Dettagliata per Classe di Asset (Scenario Mediano)")
+        st.markdown("""
+        Qui analizziamo separatamente le tre componenti principali del tuo patrimonio. Ogni grafico mostra sia il **valore nominale** (la cifra assoluta) sia il **valore reale** (il potere d'acquisto odierno, tenendo conto dell'inflazione). Questo ti permette di vedere la crescita di ogni asset e l'impatto di eventi come la liquidazione del fondo pensione sulla liquidità.
+        """)
 
-    # Grafico 1: Liquidità
-    fig_banca = plot_individual_asset_chart(
-        real_data=dati_tabella.get('saldo_banca_reale', np.zeros(st.session_state.parametri['anni_totali'] + 1)),
-        nominal_data=dati_tabella.get('saldo_banca_nominale', np.zeros(st.session_state.parametri['anni_totali'] + 1)),
-        title="Evoluzione della Liquidità (Conto Corrente)",
-        anni_totali=st.session_state.parametri['anni_totali'],
-        eta_iniziale=st.session_state.parametri['eta_iniziale']
-    )
-    fig_banca.add_vline(x=st.session_state.parametri['eta_iniziale'] + st.session_state.parametri['anni_inizio_prelievo'], line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
-    st.plotly_chart(fig_banca, use_container_width=True)
-
-    # Grafico 2: ETF
-    fig_etf = plot_individual_asset_chart(
-        real_data=dati_tabella.get('saldo_etf_reale', np.zeros(st.session_state.parametri['anni_totali'] + 1)),
-        nominal_data=dati_tabella.get('saldo_etf_nominale', np.zeros(st.session_state.parametri['anni_totali'] + 1)),
-        title="Evoluzione del Portafoglio ETF",
-        anni_totali=st.session_state.parametri['anni_totali'],
-        eta_iniziale=st.session_state.parametri['eta_iniziale']
-    )
-    fig_etf.add_vline(x=st.session_state.parametri['eta_iniziale'] + st.session_state.parametri['anni_inizio_prelievo'], line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
-    st.plotly_chart(fig_etf, use_container_width=True)
-        
-    # Grafico 3: Fondo Pensione
-    if st.session_state.parametri.get('attiva_fondo_pensione', False):
-        fig_fp = plot_individual_asset_chart(
-            real_data=dati_tabella.get('saldo_fp_reale', np.zeros(st.session_state.parametri['anni_totali'] + 1)),
-            nominal_data=dati_tabella.get('saldo_fp_nominale', np.zeros(st.session_state.parametri['anni_totali'] + 1)),
-            title="Evoluzione del Fondo Pensione",
+        # Grafico 1: Liquidità
+        fig_banca = plot_individual_asset_chart(
+            real_data=get_serie(dati_tabella, 'saldo_banca_reale', st.session_state.parametri['anni_totali'] + 1),
+            nominal_data=get_serie(dati_tabella, 'saldo_banca_nominale', st.session_state.parametri['anni_totali'] + 1),
+            title="Evoluzione della Liquidità (Conto Corrente)",
             anni_totali=st.session_state.parametri['anni_totali'],
-            eta_iniziale=st.session_state.parametri['eta_iniziale']
+            eta_iniziale=st.session_state.parametri['eta_iniziale'],
+            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo']
+        )
+        st.plotly_chart(fig_banca, use_container_width=True)
+
+        # Grafico 2: ETF
+        fig_etf = plot_individual_asset_chart(
+            real_data=get_serie(dati_tabella, 'saldo_etf_reale', st.session_state.parametri['anni_totali'] + 1),
+            nominal_data=get_serie(dati_tabella, 'saldo_etf_nominale', st.session_state.parametri['anni_totali'] + 1),
+            title="Evoluzione del Portafoglio ETF",
+            anni_totali=st.session_state.parametri['anni_totali'],
+            eta_iniziale=st.session_state.parametri['eta_iniziale'],
+            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo']
         )
-        fig_fp.add_vline(x=st.session_state.parametri['eta_iniziale'] + st.session_state.parametri['anni_inizio_prelievo'], line_width=2, line_dash="dash", line_color="grey", annotation_text="Inizio Prelievi")
-        st.plotly_chart(fig_fp, use_container_width=True)
+        st.plotly_chart(fig_etf, use_container_width=True)
+        
+        # Grafico 3: Fondo Pensione
+        if st.session_state.parametri.get('attiva_fondo_pensione', False):
+            fig_fp = plot_individual_asset_chart(
+                real_data=get_serie(dati_tabella, 'saldo_fp_reale', st.session_state.parametri['anni_totali'] + 1),
+                nominal_data=get_serie(dati_tabella, 'saldo_fp_nominale', st.session_state.parametri['anni_totali'] + 1),
+                title="Evoluzione del Fondo Pensione",
+                anni_totali=st.session_state.parametri['anni_totali'],
+                eta_iniziale=st.session_state.parametri['eta_iniziale'],
+                anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo']
+            )
+            st.plotly_chart(fig_fp, use_container_width=True)
 
 
 with tabs[2]: # Analisi dei Redditi
-    dati_principali = st.session_state.risultati['dati_grafici_principali']
-    dati_tabella = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
+    if tabs[2].open:
+        dati_principali = st.session_state.risultati['dati_grafici_principali']
+        dati_tabella = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
         
-    st.subheader("Come si comporrà il tuo reddito in pensione? (Scenario Mediano)")
-    st.markdown("""
-    Questa sezione analizza le tue fonti di reddito durante la fase di prelievo. I valori sono **reali** (potere d'acquisto di oggi) per darti un'idea concreta del tuo tenore di vita.
-    Puoi vedere come i prelievi dal patrimonio vengono progressivamente sostituiti o integrati da pensione e rendite.
-    """)
+        st.subheader("Come si comporrà il tuo reddito in pensione? (Scenario Mediano)")
+        st.markdown("""
+        Questa sezione analizza le tue fonti di reddito durante la fase di prelievo. I valori sono **reali** (potere d'acquisto di oggi) per darti un'idea concreta del tuo tenore di vita.
+        Puoi vedere come i prelievi dal patrimonio vengono progressivamente sostituiti o integrati da pensione e rendite.
+        """)
         
-    # Grafico 1: Composizione del Reddito Annuo Reale
-    fig_composizione_reddito = plot_income_composition(
-        dati_tabella, 
-        st.session_state.parametri['anni_totali'], 
-        eta_iniziale=st.session_state.parametri['eta_iniziale']
-    )
-    st.plotly_chart(fig_composizione_reddito, use_container_width=True)
+        # Grafico 1: Composizione del Reddito Annuo Reale
+        fig_composizione_reddito = plot_income_composition(
+            dati_tabella, 
+            st.session_state.parametri['anni_totali'], 
+            eta_iniziale=st.session_state.parametri['eta_iniziale']
+        )
+        st.plotly_chart(fig_composizione_reddito, use_container_width=True)
 
-    st.markdown("---")
+        st.markdown("---")
         
-    # Grafico 2: Cono di probabilità sul reddito
-    st.subheader("Quale sarà il range probabile del tuo reddito?")
-    st.markdown("""
-    Mentre il grafico precedente mostrava solo lo scenario mediano, questo grafico a "cono" mostra l'intera gamma di possibili livelli di reddito annuo reale.
-    Ti aiuta a capire l'incertezza: potresti avere anni più ricchi (parte alta del cono) o più magri (parte bassa).
-    """)
-    fig_income_cone = plot_income_cone_chart(
-        data=st.session_state.risultati['dati_grafici_principali']['reddito_reale_annuo'],
-        anni_totali=st.session_state.parametri['anni_totali'],
-        anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo'],
-        eta_iniziale=st.session_state.parametri['eta_iniziale']
-    )
-    st.plotly_chart(fig_income_cone, use_container_width=True)
+        # Grafico 2: Cono di probabilità sul reddito
+        st.subheader("Quale sarà il range probabile del tuo reddito?")
+        st.markdown("""
+        Mentre il grafico precedente mostrava solo lo scenario mediano, questo grafico a "cono" mostra l'intera gamma di possibili livelli di reddito annuo reale.
+        Ti aiuta a capire l'incertezza: potresti avere anni più ricchi (parte alta del cono) o più magri (parte bassa).
+        """)
+        fig_income_cone = plot_income_cone_chart(
+            data=st.session_state.risultati['dati_grafici_principali']['reddito_reale_annuo'],
+            anni_totali=st.session_state.parametri['anni_totali'],
+            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo'],
+            eta_iniziale=st.session_state.parametri['eta_iniziale'],
+            alta_risoluzione=alta_risoluzione_grafici
+        )
+        st.plotly_chart(fig_income_cone, use_container_width=True)
+
+        st.markdown("---")
+        st.subheader("Indicatori di Rischio e Performance del Piano (Scenario Mediano)")
+    
+        # Calcolo delle variazioni medie per fase
+        dati_mediana = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
+        variazioni_annue = get_serie(dati_mediana, 'variazione_patrimonio_percentuale', 1)
+    
+        idx_inizio_prelievo = st.session_state.parametri['anni_inizio_prelievo']
+    
+        # Filtra solo le variazioni pertinenti all'orizzonte temporale
+        variazioni_valide = variazioni_annue[:st.session_state.parametri['anni_totali']]
+    
+        variazioni_accumulo = variazioni_valide[:idx_inizio_prelievo]
+        variazioni_prelievo = variazioni_valide[idx_inizio_prelievo:]
+    
+        media_accumulo = np.mean(variazioni_accumulo) if variazioni_accumulo.size > 0 else 0
+        media_prelievo = np.mean(variazioni_prelievo) if variazioni_prelievo.size > 0 else 0
+
+        anni_prelievo = st.session_state.parametri['anni_totali'] - idx_inizio_prelievo
+
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Probabilità di Fallimento", f"{stats_aggregate['probabilita_fallimento']:.2%}", delta=f"{-stats_aggregate['probabilita_fallimento']:.2%}", delta_color="inverse", help="La percentuale di simulazioni in cui il tuo patrimonio è sceso a zero prima della fine dell'orizzonte temporale. Un valore basso è l'obiettivo principale.")
+        col2.metric("Crescita Media (Accumulo)", f"{media_accumulo:+.2%}", help=f"La crescita percentuale media annua del patrimonio durante i primi {idx_inizio_prelievo} anni (fase di accumulo).")
+        col3.metric("Crescita Media (Prelievo)", f"{media_prelievo:+.2%}", help=f"La variazione percentuale media annua del patrimonio durante gli ultimi {anni_prelievo} anni (fase di prelievo). È normale che sia negativa, poiché i prelievi superano i rendimenti.")
+        col4.metric("Drawdown Massimo Peggiore", f"{stats_aggregate['drawdown_massimo_peggiore']:.2%}", delta=f"{stats_aggregate['drawdown_massimo_peggiore']:.2%}", delta_color="inverse", help="La perdita massima percentuale subita dal tuo portafoglio dal suo picco al suo minimo in una singola simulazione. Misura la 'botta' peggiore che il tuo piano ha dovuto sopportare.")
+        col5.metric("Sharpe Ratio Medio", f"{stats_aggregate['sharpe_ratio_medio']:.2f}", help="Un indicatore che misura il rendimento del tuo portafoglio rispetto al rischio che ti sei preso. Un valore più alto indica un miglior rendimento per unità di rischio. Sopra 1.0 è considerato ottimo.")
+
+        st.markdown("---")
+        # --- Riepilogo Entrate ---
+        dati_mediana = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
 
 
-    with tabs[3]: # Analisi del Rischio
+with tabs[3]: # Analisi del Rischio
+    if tabs[3].open:
         dati_principali = st.session_state.risultati['dati_grafici_principali']
-        stats = st.session_state.risultati['statistiche']
+        stats = stats_aggregate
 
         st.subheader("La Variabilità dei Risultati: il Grafico 'Spaghetti'")
         st.markdown("""
@@ -1384,7 +2113,8 @@ with tabs[2]: # Analisi dei Redditi
             y_title='Patrimonio Reale (€)', 
             anni_totali=st.session_state.parametri['anni_totali'],
             eta_iniziale=st.session_state.parametri['eta_iniziale'],
-            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo']
+            anni_inizio_prelievo=st.session_state.parametri['anni_inizio_prelievo'],
+            alta_risoluzione=alta_risoluzione_grafici
         )
         st.plotly_chart(fig_spaghetti, use_container_width=True)
 
@@ -1400,77 +2130,39 @@ with tabs[2]: # Analisi dei Redditi
             patrimoni_finali=stats['patrimoni_reali_finali'],
             data=dati_principali['reale'],
             anni_totali=st.session_state.parametri['anni_totali'],
-            eta_iniziale=st.session_state.parametri['eta_iniziale']
+            eta_iniziale=st.session_state.parametri['eta_iniziale'],
+            worst_idx=indici_scenari_peggiori(stats['patrimoni_reali_finali']),
+            alta_risoluzione=alta_risoluzione_grafici
         )
         st.plotly_chart(fig_worst, use_container_width=True)
 
-    with tabs[4]: # Dettaglio Flussi (Mediano)
+
+with tabs[4]: # Dettaglio Flussi (Mediano)
+    if tabs[4].open:
         dati_tabella = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
 
         st.subheader("Analisi Finanziaria Annuale Dettagliata (Simulazione Mediana)")
         st.markdown("Questa sezione è la 'radiografia' dello scenario mediano (il più probabile). La tabella mostra, anno per anno, tutti i flussi finanziari e l'evoluzione del patrimonio, permettendoti di seguire ogni calcolo.")
         
-        # Costruzione del DataFrame
+        # Costruzione del DataFrame (in cache finché i dati dello scenario mediano non cambiano)
         num_anni = st.session_state.parametri['anni_totali']
-        df_index = np.arange(1, num_anni + 1)
+        df = _build_detail_df(dati_tabella, num_anni, st.session_state.parametri['eta_iniziale'])
         
-        df_data = {
-            'Anno': df_index,
-            'Età': st.session_state.parametri['eta_iniziale'] + df_index
+        # Formattazione affidata alla griglia lato browser (column_config): i valori
+        # viaggiano come numeri e non vengono convertiti in stringhe cella per cella.
+        # Lo Styler resta solo per colorare le colonne percentuali.
+        colonne_percentuali = list(COLONNE_PERCENTUALI_DETTAGLIO)
+        column_config = {
+            col: st.column_config.NumberColumn(format="€ %,.0f")
+            for col, _ in COLONNE_TABELLA_DETTAGLIO if col not in colonne_percentuali
         }
-        
-        col_keys = [
-            ('Obiettivo Prelievo (Nom.)', 'prelievi_target_nominali'),
-            ('Prelievo Effettivo (Nom.)', 'prelievi_effettivi_nominali'),
-            ('Prelievo Effettivo (Reale)', 'prelievi_effettivi_reali'),
-            ('Fonte: Conto Corrente', 'prelievi_da_banca_nominali'),
-            ('Fonte: Vendita ETF', 'prelievi_da_etf_nominali'),
-            ('Vendita ETF (Rebalance)', 'vendite_rebalance_nominali'),
-            ('Pensione Pubblica (Nom.)', 'pensioni_pubbliche_nominali'),
-            ('Rendita FP (Nom.)', 'rendite_fp_nominali'),
-            ('Liquidazione FP (Nom.)', 'fp_liquidato_nominale'),
-            # Per i saldi, partiamo dall'anno 1 per allinearli con gli anni del dataframe
-            ('Patrimonio Banca (Nom.)', 'saldo_banca_nominale'),
-            ('Patrimonio ETF (Nom.)', 'saldo_etf_nominale'),
-            ('Patrimonio FP (Nom.)', 'saldo_fp_nominale'),
-            ('Patrimonio Banca (Reale)', 'saldo_banca_reale'),
-            ('Patrimonio ETF (Reale)', 'saldo_etf_reale'),
-            ('Patrimonio FP (Reale)', 'saldo_fp_reale'),
-            ('Variazione Netta Patrimonio %', 'variazione_patrimonio_percentuale'),
-            ('Rendimento Portafoglio %', 'rendimento_investimento_percentuale')
-        ]
+        # Segno sempre esplicito e due decimali, come le metriche "Crescita Media" (:+.2%)
+        column_config.update({col: st.column_config.NumberColumn(format="%+.2f%%") for col in colonne_percentuali})
 
-        for col, key in col_keys:
-            full_array = dati_tabella.get(key, np.zeros(num_anni + 1))
-            # I dati annuali (sia flussi che saldi) sono memorizzati negli indici da 1 a num_anni.
-            # L'indice 0 è usato solo per i saldi iniziali.
-            # Quindi, per la tabella che mostra gli anni da 1 in poi, peschiamo sempre da quell'intervallo.
-            df_data[col] = full_array[1:num_anni+1]
-        
-        df = pd.DataFrame(df_data)
-        
-        st.dataframe(df.style.format({
-            'Obiettivo Prelievo (Nom.)': "€ {:,.0f}",
-            'Prelievo Effettivo (Nom.)': "€ {:,.0f}",
-            'Fonte: Conto Corrente': "€ {:,.0f}",
-            'Fonte: Vendita ETF': "€ {:,.0f}",
-            'Vendita ETF (Rebalance)': "€ {:,.0f}",
-            'Prelievo Effettivo (Reale)': "€ {:,.0f}",
-            'Pensione Pubblica (Nom.)': "€ {:,.0f}",
-            'Rendita FP (Nom.)': "€ {:,.0f}",
-            'Liquidazione FP (Nom.)': "€ {:,.0f}",
-            'Patrimonio Banca (Nom.)': "€ {:,.0f}",
-            'Patrimonio ETF (Nom.)': "€ {:,.0f}",
-            'Patrimonio FP (Nom.)': "€ {:,.0f}",
-            'Patrimonio Banca (Reale)': "€ {:,.0f}",
-            'Patrimonio ETF (Reale)': "€ {:,.0f}",
-            'Patrimonio FP (Reale)': "€ {:,.0f}",
-            'Variazione Netta Patrimonio %': '{:+.2%}',
-            'Rendimento Portafoglio %': '{:+.2%}',
-        }).apply(
-            lambda x: ['color: red' if v < 0 else 'color: green' for v in x],
-            subset=['Variazione Netta Patrimonio %', 'Rendimento Portafoglio %']
-        ))
+        st.dataframe(
+            df.style.apply(_colore_segno, subset=colonne_percentuali),
+            column_config=column_config
+        )
 
         with st.expander("Guida alla Lettura della Tabella"):
             st.markdown("""
@@ -1483,36 +2175,6 @@ with tabs[2]: # Analisi dei Redditi
             - **Entrate Anno (Reali)**: La somma di tutte le tue entrate (prelievi, pensioni) in potere d'acquisto di oggi. Questa cifra misura il tuo vero tenore di vita annuale.
             """) 
 
-    st.markdown("---")
-    st.subheader("Indicatori di Rischio e Performance del Piano (Scenario Mediano)")
-    
-    # Calcolo delle variazioni medie per fase
-    dati_mediana = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
-    variazioni_annue = np.array(dati_mediana.get('variazione_patrimonio_percentuale', [0]))
-    
-    idx_inizio_prelievo = st.session_state.parametri['anni_inizio_prelievo']
-    
-    # Filtra solo le variazioni pertinenti all'orizzonte temporale
-    variazioni_valide = variazioni_annue[:st.session_state.parametri['anni_totali']]
-    
-    variazioni_accumulo = variazioni_valide[:idx_inizio_prelievo]
-    variazioni_prelievo = variazioni_valide[idx_inizio_prelievo:]
-    
-    media_accumulo = np.mean(variazioni_accumulo) if variazioni_accumulo.size > 0 else 0
-    media_prelievo = np.mean(variazioni_prelievo) if variazioni_prelievo.size > 0 else 0
-
-    anni_prelievo = st.session_state.parametri['anni_totali'] - idx_inizio_prelievo
-
-    col1, col2, col3, col4, col5 = st.columns(5)
-    col1.metric("Probabilità di Fallimento", f"{stats['probabilita_fallimento']:.2%}", delta=f"{-stats['probabilita_fallimento']:.2%}", delta_color="inverse", help="La percentuale di simulazioni in cui il tuo patrimonio è sceso a zero prima della fine dell'orizzonte temporale. Un valore basso è l'obiettivo principale.")
-    col2.metric("Crescita Media (Accumulo)", f"{media_accumulo:+.2%}", help=f"La crescita percentuale media annua del patrimonio durante i primi {idx_inizio_prelievo} anni (fase di accumulo).")
-    col3.metric("Crescita Media (Prelievo)", f"{media_prelievo:+.2%}", help=f"La variazione percentuale media annua del patrimonio durante gli ultimi {anni_prelievo} anni (fase di prelievo). È normale che sia negativa, poiché i prelievi superano i rendimenti.")
-    col4.metric("Drawdown Massimo Peggiore", f"{stats['drawdown_massimo_peggiore']:.2%}", delta=f"{stats['drawdown_massimo_peggiore']:.2%}", delta_color="inverse", help="La perdita massima percentuale subita dal tuo portafoglio dal suo picco al suo minimo in una singola simulazione. Misura la 'botta' peggiore che il tuo piano ha dovuto sopportare.")
-    col5.metric("Sharpe Ratio Medio", f"{stats['sharpe_ratio_medio']:.2f}", help="Un indicatore che misura il rendimento del tuo portafoglio rispetto al rischio che ti sei preso. Un valore più alto indica un miglior rendimento per unità di rischio. Sopra 1.0 è considerato ottimo.")
-
-    st.markdown("---")
-    # --- Riepilogo Entrate ---
-    dati_mediana = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
 
 # --- Storico Contributi Versati (Tabella Dettagliata) ---
 dati_mediana = st.session_state.risultati['dati_grafici_avanzati']['dati_mediana']
@@ -1523,14 +2185,14 @@ contributo_mensile_etf = st.session_state.parametri['contributo_mensile_etf']
 contributo_annuo_fp = st.session_state.parametri.get('contributo_annuo_fp', 0)
 attiva_fp = st.session_state.parametri.get('attiva_fondo_pensione', False)
 indicizza = st.session_state.parametri.get('indicizza_contributi_inflazione', True)
-indici_prezzi = dati_mediana.get('indice_prezzi', np.ones(anni_totali + 1))[1:]
+indici_prezzi = (dati_mediana['indice_prezzi'] if 'indice_prezzi' in dati_mediana.dtype.names else np.ones(anni_totali + 1))[1:]
 
 # Parametri temporali per i contributi
 anni_inizio_prelievo = st.session_state.parametri['anni_inizio_prelievo']
 eta_ritiro_fp = st.session_state.parametri.get('eta_ritiro_fp', 67)
 inizio_pensione_anni = st.session_state.parametri.get('inizio_pensione_anni', 40)
 
-anni = np.arange(1, anni_totali + 1)
+anni = indice_anni(anni_totali)
 
 # Contributi conto corrente e ETF: si fermano all'inizio dei prelievi
 contributi_conto_nom = np.where(anni <= anni_inizio_prelievo, contributo_mensile_banca * 12, 0)
@@ -1595,19 +2257,9 @@ with st.expander('📊 Storico Contributi Versati (dettaglio anno per anno)', ex
         'Cumul. FP (Reale)': cumul_fp_reale,
         'Totale Cumul. (Reale)': cumul_totale_reale,
     })
-    st.dataframe(df_contributi.style.format({
-        'Contributi Conto (Nominale)': '€ {:,.0f}',
-        'Cumul. Conto (Nominale)': '€ {:,.0f}',
-        'Contributi ETF (Nominale)': '€ {:,.0f}',
-        'Cumul. ETF (Nominale)': '€ {:,.0f}',
-        'Contributi FP (Nominale)': '€ {:,.0f}',
-        'Cumul. FP (Nominale)': '€ {:,.0f}',
-        'Totale Cumul. (Nominale)': '€ {:,.0f}',
-        'Contributi Conto (Reale)': '€ {:,.0f}',
-        'Cumul. Conto (Reale)': '€ {:,.0f}',
-        'Contributi ETF (Reale)': '€ {:,.0f}',
-        'Cumul. ETF (Reale)': '€ {:,.0f}',
-        'Contributi FP (Reale)': '€ {:,.0f}',
-        'Cumul. FP (Reale)': '€ {:,.0f}',
-        'Totale Cumul. (Reale)': '€ {:,.0f}',
-    }))
\ No newline at end of file
+    # Formattazione nella griglia lato browser (come per la tabella dei flussi):
+    # nessuno Styler che converte in stringa ogni cella a ogni rerun
+    st.dataframe(df_contributi, column_config={
+        col: st.column_config.NumberColumn(format="€ %,.0f")
+        for col in df_contributi.columns if col not in ('Anno', 'Età')
+    })
\ No newline at end of file
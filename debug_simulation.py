@@ -154,9 +154,9 @@ def debug_single_simulation():
         banca = dati_mediana['saldo_banca_nominale'][anno]
         etf = dati_mediana['saldo_etf_nominale'][anno]
         fp = dati_mediana['saldo_fp_nominale'][anno]
-        prelievi = dati_mediana['prelievi_effettivi_nominali'][anno] if 'prelievi_effettivi_nominali' in dati_mediana else 0
-        contributi = dati_mediana['contributi_totali_versati'][anno] - dati_mediana['contributi_totali_versati'][anno-1] if 'contributi_totali_versati' in dati_mediana else 0
-        rendimento = dati_mediana['rendimento_investimento_percentuale'][anno] if 'rendimento_investimento_percentuale' in dati_mediana else 0
+        prelievi = dati_mediana['prelievi_effettivi_nominali'][anno] if 'prelievi_effettivi_nominali' in dati_mediana.dtype.names else 0
+        contributi = dati_mediana['contributi_totali_versati'][anno] - dati_mediana['contributi_totali_versati'][anno-1] if 'contributi_totali_versati' in dati_mediana.dtype.names else 0
+        rendimento = dati_mediana['rendimento_investimento_percentuale'][anno] if 'rendimento_investimento_percentuale' in dati_mediana.dtype.names else 0
         print(f"Anno {anno:2d}: Banca €{banca:,.0f} | ETF €{etf:,.0f} | FP €{fp:,.0f} | Contributi €{contributi:,.0f} | Prelievi €{prelievi:,.0f} | Rend. {rendimento:+.2%}")
     print()
     
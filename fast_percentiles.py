@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Calcolo veloce dei percentili per colonna sulle matrici delle simulazioni.
+
+I grafici a "cono di probabilità" richiedono, per ogni anno, alcuni percentili
+calcolati su tutte le simulazioni (matrici simulazioni x anni). `np.percentile`
+ordina interamente ogni colonna ed è single-thread; qui invece ogni colonna viene
+elaborata con una selezione parziale (`np.partition`, O(n)) e le colonne vengono
+distribuite su più core tramite Numba.
+
+Se Numba non è installato il modulo ripiega su un'unica `np.partition` vettoriale
+lungo l'asse delle simulazioni, con risultati identici a `np.percentile`
+(interpolazione lineare).
+"""
+
+import numpy as np
+
+try:
+    import numba
+    from numba import njit, prange
+    # OpenMP per primo: è thread-safe (Streamlit serve ogni sessione su un thread
+    # diverso) e, a differenza di TBB, non blocca la chiusura del processo.
+    numba.config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+    NUMBA_DISPONIBILE = True
+except ImportError:  # pragma: no cover - dipende dall'ambiente
+    NUMBA_DISPONIBILE = False
+
+
+def _indici_interpolazione(n, qs):
+    """
+    Calcola, per ogni percentile richiesto, i due ranghi da selezionare e il peso
+    dell'interpolazione lineare (stessa convenzione di `np.percentile`).
+
+    Args:
+        n (int): Numero di osservazioni per colonna.
+        qs (np.ndarray): Percentili richiesti (0-100).
+
+    Returns:
+        tuple: (rango inferiore, rango superiore, frazione) come array NumPy.
+    """
+    posizioni = np.asarray(qs, dtype=np.float64) / 100.0 * (n - 1)
+    bassi = np.floor(posizioni).astype(np.int64)
+    alti = np.minimum(bassi + 1, n - 1)
+    return bassi, alti, posizioni - bassi
+
+
+if NUMBA_DISPONIBILE:
+    @njit(parallel=True, cache=True)
+    def _col_percentiles_numba(data, bassi, alti, frazioni, ranghi):
+        m = data.shape[1]
+        risultato = np.empty((bassi.shape[0], m), dtype=np.float64)
+        for j in prange(m):
+            # Copia della colonna in un buffer locale: la selezione parziale la riordina
+            colonna = np.partition(data[:, j].copy(), ranghi)
+            for i in range(bassi.shape[0]):
+                v_basso = colonna[bassi[i]]
+                risultato[i, j] = v_basso + (colonna[alti[i]] - v_basso) * frazioni[i]
+        return risultato
+
+
+def col_percentiles(data, qs):
+    """
+    Calcola più percentili lungo l'asse 0 (simulazioni) in un unico passaggio.
+
+    Args:
+        data (np.ndarray): Matrice dei dati (simulazioni x anni).
+        qs (list): Percentili richiesti (es. [10, 25, 50, 75, 90]).
+
+    Returns:
+        np.ndarray: Matrice (len(qs) x anni), equivalente a
+            `np.percentile(data, qs, axis=0)`.
+    """
+    data = np.asarray(data)
+    if data.ndim != 2 or data.shape[0] == 0:
+        return np.percentile(data, qs, axis=0)
+    bassi, alti, frazioni = _indici_interpolazione(data.shape[0], qs)
+    ranghi = np.unique(np.concatenate((bassi, alti)))
+    if NUMBA_DISPONIBILE:
+        return _col_percentiles_numba(np.ascontiguousarray(data), bassi, alti, frazioni, ranghi)
+    # Senza Numba: una sola selezione parziale per tutti i ranghi richiesti
+    parziale = np.partition(data, ranghi, axis=0).astype(np.float64, copy=False)
+    v_bassi = parziale[bassi]
+    return v_bassi + (parziale[alti] - v_bassi) * frazioni[:, None]
+
+
+def warmup():
+    """
+    Forza la compilazione del kernel Numba su un input minimo, in modo che il
+    costo di compilazione non ricada sul primo grafico mostrato all'utente.
+    """
+    col_percentiles(np.zeros((2, 2)), [50])
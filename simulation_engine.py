@@ -97,29 +97,56 @@ def _get_regime_params(model_name):
     """
     return ECONOMIC_MODELS.get(model_name, ECONOMIC_MODELS["VOLATILE (CICLI BOOM-BUST)"])
 
-def _choose_next_regime(current_regime, regime_definitions):
+def _prepara_regimi(regime_definitions):
     """
-    Determina il regime del mese successivo utilizzando una catena di Markov.
-
-    Basandosi sul regime attuale, questa funzione estrae le probabilità di
-    transizione verso altri regimi (o di rimanere nello stesso) e ne sceglie
-    uno in modo probabilistico.
+    Converte le definizioni dei regimi in array NumPy, così che la catena di
+    Markov possa avanzare per tutte le simulazioni contemporaneamente.
 
     Args:
-        current_regime (str): Il nome del regime attuale (es. 'Normal', 'Crash').
         regime_definitions (dict): La parte del dizionario del modello economico
             che contiene le definizioni dei regimi (es. `market_regimes`).
 
     Returns:
-        str: Il nome del regime scelto per il mese successivo.
+        tuple: (rendimenti medi, volatilità, matrice delle probabilità di
+            transizione cumulate), indicizzati per posizione del regime.
+    """
+    nomi = list(regime_definitions.keys())
+    indici = {nome: i for i, nome in enumerate(nomi)}
+    medie = np.array([regime_definitions[nome]['mean'] for nome in nomi])
+    volatilita = np.array([regime_definitions[nome]['vol'] for nome in nomi])
+
+    transizioni = np.zeros((len(nomi), len(nomi)))
+    for i, nome in enumerate(nomi):
+        probabilita = regime_definitions[nome].get('transitions')
+        if not probabilita:
+            transizioni[i, i] = 1.0  # Se non ci sono transizioni, rimane nello stesso stato
+            continue
+        for destinazione, p in probabilita.items():
+            transizioni[i, indici[destinazione]] = p
+    return medie, volatilita, np.cumsum(transizioni, axis=1)
+
+def _choose_next_regime(regimi_correnti, transizioni_cumulate, estrazioni):
+    """
+    Determina il regime del mese successivo utilizzando una catena di Markov,
+    per tutte le simulazioni in un colpo solo.
+
+    Per ogni simulazione il numero uniforme estratto viene confrontato con le
+    probabilità di transizione cumulate della riga del regime attuale.
+
+    Args:
+        regimi_correnti (np.ndarray): Indice del regime attuale di ogni simulazione.
+        transizioni_cumulate (np.ndarray): Matrice (regimi x regimi) delle
+            probabilità di transizione cumulate (vedi `_prepara_regimi`).
+        estrazioni (np.ndarray): Un numero uniforme in [0, 1) per simulazione.
+
+    Returns:
+        np.ndarray: L'indice del regime scelto per il mese successivo.
     """
-    if not regime_definitions.get(current_regime, {}).get('transitions'):
-        return current_regime # Se non ci sono transizioni, rimane nello stesso stato
-    transitions = regime_definitions[current_regime]['transitions']
-    regimes, probs = zip(*transitions.items())
-    return np.random.choice(regimes, p=probs)
+    prossimi = (estrazioni[:, None] >= transizioni_cumulate[regimi_correnti]).sum(axis=1)
+    # Protegge da probabilità che, per arrotondamento, sommano a poco meno di 1
+    return np.minimum(prossimi, transizioni_cumulate.shape[0] - 1)
 
-def _calcola_sharpe_ratio_medio(tutti_i_dati_annuali):
+def _calcola_sharpe_ratio_medio(variazioni_annuali):
     """
     Calcola lo Sharpe Ratio medio basato sulle variazioni percentuali annuali
     del patrimonio di tutte le simulazioni.
@@ -127,28 +154,18 @@ def _calcola_sharpe_ratio_medio(tutti_i_dati_annuali):
     Lo Sharpe Ratio è definito come: (Rendimento Medio - Tasso Risk-Free) / Deviazione Standard
     
     Args:
-        tutti_i_dati_annuali (list): Lista di dizionari contenenti i dati annuali di ogni simulazione.
+        variazioni_annuali (np.ndarray): Matrice (simulazioni x anni) delle
+            variazioni percentuali annuali del patrimonio.
         
     Returns:
         float: Lo Sharpe Ratio medio calcolato.
     """
-    if not tutti_i_dati_annuali:
-        return 0.0
-    
-    # Raccogli tutte le variazioni percentuali annuali da tutte le simulazioni
-    tutte_le_variazioni = []
-    for dati_simulazione in tutti_i_dati_annuali:
-        variazioni = dati_simulazione.get('variazione_patrimonio_percentuale', [])
-        # Filtra valori validi (escludi NaN e infiniti)
-        variazioni_valide = [v for v in variazioni if np.isfinite(v)]
-        tutte_le_variazioni.extend(variazioni_valide)
+    # Filtra valori validi (escludi NaN e infiniti)
+    variazioni_array = variazioni_annuali[np.isfinite(variazioni_annuali)]
     
-    if not tutte_le_variazioni:
+    if variazioni_array.size == 0:
         return 0.0
     
-    # Converti in array numpy
-    variazioni_array = np.array(tutte_le_variazioni)
-    
     # Calcola rendimento medio e deviazione standard
     rendimento_medio = np.mean(variazioni_array)
     deviazione_standard = np.std(variazioni_array)
@@ -262,17 +279,17 @@ def _calcola_allocazione_annuale(parametri):
         fine_glidepath = parametri.get('fine_glidepath_anni', 40)
         allocazione_finale = parametri.get('allocazione_etf_finale', 0.333)
         
-        for anno in range(anni_totali):
-            if anno < inizio_glidepath:
-                # Fase accumulo: allocazione costante
-                allocazioni_annuali[anno] = allocazione_iniziale
-            elif anno >= fine_glidepath:
-                # Fase finale: allocazione target
-                allocazioni_annuali[anno] = allocazione_finale
-            else:
-                # Fase transizione: riduzione lineare
-                progresso = (anno - inizio_glidepath) / (fine_glidepath - inizio_glidepath)
-                allocazioni_annuali[anno] = allocazione_iniziale + progresso * (allocazione_finale - allocazione_iniziale)
+        anni = np.arange(anni_totali)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Fase transizione: riduzione lineare
+            progresso = (anni - inizio_glidepath) / (fine_glidepath - inizio_glidepath)
+        allocazioni_annuali[:] = np.where(
+            anni < inizio_glidepath, allocazione_iniziale,  # Fase accumulo: allocazione costante
+            np.where(
+                anni >= fine_glidepath, allocazione_finale,  # Fase finale: allocazione target
+                allocazione_iniziale + progresso * (allocazione_finale - allocazione_iniziale)
+            )
+        )
                 
     elif strategia_ribilanciamento == 'ANNUALE_FISSO':
         # Ribilanciamento annuale a allocazione fissa
@@ -285,19 +302,32 @@ def _calcola_allocazione_annuale(parametri):
     
     return allocazioni_annuali
 
-def _esegui_una_simulazione(parametri, prelievo_annuo_da_usare):
+def _esegui_simulazioni(parametri, prelievo_annuo_da_usare, n_sim, rng):
     """
-    Esegue una singola traiettoria di simulazione finanziaria.
-    Questa funzione è stata completamente riscritta per garantire la correttezza contabile.
+    Esegue tutte le traiettorie della simulazione finanziaria in parallelo.
+
+    Lo stato di ogni grandezza (saldi, cost basis, indice dei prezzi, regimi...)
+    è un array con un elemento per simulazione: il ciclo Python avanza solo
+    lungo i mesi, mentre le operazioni sulle simulazioni sono vettoriali.
+    Le condizioni che in una singola traiettoria erano degli `if` sui saldi
+    diventano maschere booleane (`np.where`), con la stessa logica contabile.
+
+    Args:
+        parametri (dict): Parametri della simulazione.
+        prelievo_annuo_da_usare (float): Prelievo annuo per la strategia FISSO.
+        n_sim (int): Numero di simulazioni.
+        rng (np.random.Generator): Generatore di numeri casuali.
+
+    Returns:
+        dict: Dati annuali (matrici simulazioni x anni) e risultati per simulazione.
     """
     # --- 1. SETUP INIZIALE ---
-    np.random.seed()
     num_anni = parametri['anni_totali']
     mesi_totali = num_anni * 12
     inizio_prelievo_mesi = parametri['anni_inizio_prelievo'] * 12
 
-    # Inizializzazione dei contenitori per i dati annuali
-    dati_annuali = {k: np.zeros(num_anni + 1) for k in [
+    # Inizializzazione dei contenitori per i dati annuali (simulazioni x anni)
+    dati_annuali = {k: np.zeros((n_sim, num_anni + 1)) for k in [
         'saldo_banca_nominale', 'saldo_etf_nominale', 'saldo_fp_nominale',
         'saldo_banca_reale', 'saldo_etf_reale', 'saldo_fp_reale',
         'stipendi_netti_nominali',
@@ -311,40 +341,48 @@ def _esegui_una_simulazione(parametri, prelievo_annuo_da_usare):
         'vendite_rebalance_nominali'
     ]}
 
-    # Stato iniziale dei saldi e delle variabili
-    patrimonio_banca = parametri['capitale_iniziale']
-    patrimonio_etf = parametri['etf_iniziale']
-    etf_cost_basis = patrimonio_etf
-    patrimonio_fp = 0
-    contributi_totali_fp = 0
-    etf_cashflow_anno = 0.0
+    # Stato iniziale dei saldi e delle variabili (un valore per simulazione)
+    patrimonio_banca = np.full(n_sim, float(parametri['capitale_iniziale']))
+    patrimonio_etf = np.full(n_sim, float(parametri['etf_iniziale']))
+    etf_cost_basis = patrimonio_etf.copy()
+    patrimonio_fp = np.zeros(n_sim)
+    contributi_totali_fp = 0.0  # Uguale per tutte le simulazioni
+    etf_cashflow_anno = np.zeros(n_sim)
     
-    dati_annuali['saldo_banca_nominale'][0] = patrimonio_banca
-    dati_annuali['saldo_etf_nominale'][0] = patrimonio_etf
-    dati_annuali['indice_prezzi'][0] = 1.0
+    dati_annuali['saldo_banca_nominale'][:, 0] = patrimonio_banca
+    dati_annuali['saldo_etf_nominale'][:, 0] = patrimonio_etf
+    dati_annuali['indice_prezzi'][:, 0] = 1.0
 
     # Variabili di stato della simulazione
-    indice_prezzi = 1.0
-    contributi_totali_accumulati = 0
-    guadagni_accumulo = 0
+    indice_prezzi = np.ones(n_sim)
+    contributi_totali_accumulati = np.zeros(n_sim)
+    guadagni_accumulo = np.zeros(n_sim)
     guadagni_calcolati = False
     
-    prelievo_annuo_nominale_corrente = 0.0
-    prelievo_annuo_nominale_iniziale = 0.0
-    indice_prezzi_inizio_pensione = 1.0
+    prelievo_annuo_nominale_corrente = np.zeros(n_sim)
+    prelievo_annuo_nominale_iniziale = np.zeros(n_sim)
 
     # Variabili di stato per la gestione della rendita FP
-    rendita_fp_mese = 0
-    rendita_fp_mese_iniziale = 0
-    mesi_rimanenti_rendita_fp = 0
+    rendita_fp_mese = np.zeros(n_sim)
+    rendita_fp_mese_iniziale = np.zeros(n_sim)
+    mesi_rimanenti_rendita_fp = np.zeros(n_sim, dtype=np.int64)
 
     # Modello economico a regimi
     model_name = parametri.get('economic_model', "VOLATILE (CICLI BOOM-BUST)")
     economic_model_params = _get_regime_params(model_name)
-    market_regime_definitions = economic_model_params['market_regimes']
-    inflation_regime_definitions = economic_model_params['inflation_regimes']
-    current_market_regime = np.random.choice(list(market_regime_definitions.keys()))
-    current_inflation_regime = np.random.choice(list(inflation_regime_definitions.keys()))
+    medie_mercato, vol_mercato, transizioni_mercato = _prepara_regimi(economic_model_params['market_regimes'])
+    medie_inflazione, vol_inflazione, transizioni_inflazione = _prepara_regimi(economic_model_params['inflation_regimes'])
+    current_market_regime = rng.integers(len(medie_mercato), size=n_sim)
+    current_inflation_regime = rng.integers(len(medie_inflazione), size=n_sim)
+
+    # Numeri casuali di tutta la simulazione estratti in blocco (una riga per mese):
+    # poche chiamate al generatore invece di quattro per ogni mese
+    shock_rendimenti = rng.standard_normal((mesi_totali, n_sim))
+    shock_inflazione = rng.standard_normal((mesi_totali, n_sim))
+    estrazioni_mercato = rng.random((mesi_totali, n_sim))
+    estrazioni_inflazione = rng.random((mesi_totali, n_sim))
+    if parametri.get('attiva_fondo_pensione', False):
+        shock_fp = rng.standard_normal((num_anni, n_sim))
 
     # --- LOGICA COMBINAZIONE PARAMETRI RENDIMENTO ---
     modalita_parametri = parametri.get('modalita_parametri_rendimento', 'Combinazione Pesata')
@@ -352,89 +390,118 @@ def _esegui_una_simulazione(parametri, prelievo_annuo_da_usare):
     rendimento_portafoglio = parametri.get('rendimento_medio', 0.06)
     volatilita_portafoglio = parametri.get('volatilita', 0.12)
 
+    # --- SCEGLI I PARAMETRI DI RENDIMENTO/VOlATILITÀ DA USARE ---
+    # Tabelle mensili con un valore per regime, calcolate una sola volta: nel ciclo
+    # basta indicizzarle con il regime corrente di ogni simulazione
+    if modalita_parametri == 'Solo Modello Economico':
+        medie_mensili = medie_mercato / 12
+        vol_mensili = vol_mercato / np.sqrt(12)
+    elif modalita_parametri == 'Solo Portafoglio ETF':
+        medie_mensili = np.full(len(medie_mercato), rendimento_portafoglio / 12)
+        vol_mensili = np.full(len(vol_mercato), volatilita_portafoglio / np.sqrt(12))
+    else:  # Combinazione Pesata
+        medie_mensili = (peso_azioni * medie_mercato + (1 - peso_azioni) * rendimento_portafoglio) / 12
+        vol_mensili = (peso_azioni * vol_mercato + (1 - peso_azioni) * volatilita_portafoglio) / np.sqrt(12)
+    medie_inflazione_mensili = medie_inflazione / 12
+    vol_inflazione_mensili = vol_inflazione / np.sqrt(12)
+
+    # Allocazione ETF target di ogni anno, calcolata una sola volta per tutta la simulazione
+    allocazioni_annuali = _calcola_allocazione_annuale(parametri)
+
+    # Parametri usati a ogni mese, letti una sola volta dal dizionario
+    eta_iniziale = parametri['eta_iniziale']
+    attiva_fondo_pensione = parametri.get('attiva_fondo_pensione', False)
+    inizio_pensione_mesi = parametri.get('inizio_pensione_anni', num_anni + 1) * 12
+    pensione_annua_reale = parametri.get('pensione_pubblica_annua', 0)
+    indicizza_inflazione = parametri.get('indicizza_contributi_inflazione', True)
+    contributo_mensile_banca = parametri['contributo_mensile_banca']
+    contributo_mensile_etf = parametri['contributo_mensile_etf']
+    strategia_prelievo = parametri['strategia_prelievo']
+    tassazione_capital_gain = parametri['tassazione_capital_gain']
+    ter_etf_mensile = parametri['ter_etf'] / 12
+    costo_fisso_mensile = parametri.get('costo_fisso_etf_mensile', 0.0)
+    ribilancia = parametri.get('strategia_ribilanciamento', 'GLIDEPATH') != 'NESSUNO'
+
     # --- 2. LOOP DI SIMULAZIONE MENSILE ---
     for mese in range(1, mesi_totali + 1):
         anno_corrente = (mese - 1) // 12 + 1
-        eta_attuale = parametri['eta_iniziale'] + (mese - 1) / 12
+        eta_attuale = eta_iniziale + (mese - 1) / 12
 
         # A. GESTIONE EVENTI E FONDO PENSIONE
-        if parametri.get('attiva_fondo_pensione', False):
+        if attiva_fondo_pensione:
             # Evento di liquidazione all'età di ritiro (eseguito solo una volta)
-            if int(eta_attuale) == parametri.get('eta_ritiro_fp', 67) and mese % 12 == 1 and patrimonio_fp > 0:
+            if int(eta_attuale) == parametri.get('eta_ritiro_fp', 67) and mese % 12 == 1:
+                da_liquidare = patrimonio_fp > 0
                 guadagni_fp = patrimonio_fp - contributi_totali_fp
-                tasse_fp = max(0, guadagni_fp) * parametri.get('aliquota_finale_fp', 0.15)
+                tasse_fp = np.maximum(0, guadagni_fp) * parametri.get('aliquota_finale_fp', 0.15)
                 patrimonio_fp_netto = patrimonio_fp - tasse_fp
                 
                 percentuale_capitale = parametri.get('percentuale_capitale_fp', 0.5)
-                capitale_liquidato = patrimonio_fp_netto * percentuale_capitale
+                capitale_liquidato = np.where(da_liquidare, patrimonio_fp_netto * percentuale_capitale, 0.0)
                 importo_per_rendita = patrimonio_fp_netto - capitale_liquidato
                 
                 patrimonio_banca += capitale_liquidato
                 
                 # Salva la liquidazione FP nell'anno corrente (sia nominale che reale)
-                dati_annuali['fp_liquidato_nominale'][anno_corrente] += capitale_liquidato
-                dati_annuali['fp_liquidato_reale'][anno_corrente] += capitale_liquidato / indice_prezzi
+                dati_annuali['fp_liquidato_nominale'][:, anno_corrente] += capitale_liquidato
+                dati_annuali['fp_liquidato_reale'][:, anno_corrente] += capitale_liquidato / indice_prezzi
                 
                 durata_rendita_anni = parametri.get('durata_rendita_fp_anni', 25)
                 if durata_rendita_anni > 0:
-                    mesi_rimanenti_rendita_fp = durata_rendita_anni * 12
+                    mesi_rendita = durata_rendita_anni * 12
+                    mesi_rimanenti_rendita_fp = np.where(da_liquidare, mesi_rendita, mesi_rimanenti_rendita_fp)
                     # Calcola rendita mensile iniziale (verrà rivalutata per inflazione)
-                    rendita_fp_mese_iniziale = importo_per_rendita / mesi_rimanenti_rendita_fp if mesi_rimanenti_rendita_fp > 0 else 0
-                    rendita_fp_mese = rendita_fp_mese_iniziale
+                    rendita_fp_mese_iniziale = np.where(da_liquidare, importo_per_rendita / mesi_rendita, rendita_fp_mese_iniziale)
+                    rendita_fp_mese = np.where(da_liquidare, rendita_fp_mese_iniziale, rendita_fp_mese)
                 
-                patrimonio_fp = 0 # Il fondo viene azzerato
+                patrimonio_fp = np.where(da_liquidare, 0.0, patrimonio_fp) # Il fondo viene azzerato
 
             # Erogazione della rendita mensile (rivalutata per inflazione)
-            if mesi_rimanenti_rendita_fp > 0:
-                # Rivaluta la rendita per inflazione
-                rendita_fp_mese = rendita_fp_mese_iniziale * indice_prezzi
-                mesi_rimanenti_rendita_fp -= 1
-            
-            if mesi_rimanenti_rendita_fp == 0:
-                rendita_fp_mese = 0
+            in_erogazione = mesi_rimanenti_rendita_fp > 0
+            rendita_fp_mese = np.where(in_erogazione, rendita_fp_mese_iniziale * indice_prezzi, rendita_fp_mese)
+            mesi_rimanenti_rendita_fp = np.where(in_erogazione, mesi_rimanenti_rendita_fp - 1, mesi_rimanenti_rendita_fp)
+            rendita_fp_mese = np.where(mesi_rimanenti_rendita_fp == 0, 0.0, rendita_fp_mese)
         
         # B. ENTRATE MENSILI E AGGIORNAMENTO DATI
         # Calcolo Pensione Pubblica
-        pensione_pubblica_mese = 0
-        inizio_pensione_mesi = parametri.get('inizio_pensione_anni', num_anni + 1) * 12
+        pensione_pubblica_mese = 0.0
         if mese >= inizio_pensione_mesi:
             # La pensione pubblica impostata dall'utente è in termini reali
             # Deve essere rivalutata per inflazione per mantenere il potere d'acquisto
-            pensione_annua_reale = parametri.get('pensione_pubblica_annua', 0)
             pensione_annua_nominale = pensione_annua_reale * indice_prezzi
             pensione_pubblica_mese = pensione_annua_nominale / 12
         
         # Aggiornamento contabile: accredito entrate e salvataggio dati
         patrimonio_banca += pensione_pubblica_mese + rendita_fp_mese
         
-        dati_annuali['pensioni_pubbliche_nominali'][anno_corrente] += pensione_pubblica_mese
-        dati_annuali['pensioni_pubbliche_reali'][anno_corrente] += pensione_pubblica_mese / indice_prezzi
-        dati_annuali['rendite_fp_nominali'][anno_corrente] += rendita_fp_mese
-        dati_annuali['rendite_fp_reali'][anno_corrente] += rendita_fp_mese / indice_prezzi
+        dati_annuali['pensioni_pubbliche_nominali'][:, anno_corrente] += pensione_pubblica_mese
+        dati_annuali['pensioni_pubbliche_reali'][:, anno_corrente] += pensione_pubblica_mese / indice_prezzi
+        dati_annuali['rendite_fp_nominali'][:, anno_corrente] += rendita_fp_mese
+        dati_annuali['rendite_fp_reali'][:, anno_corrente] += rendita_fp_mese / indice_prezzi
         
         reddito_da_pensioni_reale = (pensione_pubblica_mese + rendita_fp_mese) / indice_prezzi
-        dati_annuali['reddito_totale_reale'][anno_corrente] += reddito_da_pensioni_reale
+        dati_annuali['reddito_totale_reale'][:, anno_corrente] += reddito_da_pensioni_reale
 
         # C. FASE DI ACCUMULO (prima dei rendimenti)
         if mese < inizio_prelievo_mesi:
-            if parametri.get('indicizza_contributi_inflazione', True):
-                contributo_mensile_banca_nominale = parametri['contributo_mensile_banca'] * indice_prezzi
-                contributo_mensile_etf_nominale = parametri['contributo_mensile_etf'] * indice_prezzi
+            if indicizza_inflazione:
+                contributo_mensile_banca_nominale = contributo_mensile_banca * indice_prezzi
+                contributo_mensile_etf_nominale = contributo_mensile_etf * indice_prezzi
             else:
-                contributo_mensile_banca_nominale = parametri['contributo_mensile_banca']
-                contributo_mensile_etf_nominale = parametri['contributo_mensile_etf']
+                contributo_mensile_banca_nominale = contributo_mensile_banca
+                contributo_mensile_etf_nominale = contributo_mensile_etf
 
             patrimonio_banca += contributo_mensile_banca_nominale
             contributi_totali_accumulati += contributo_mensile_banca_nominale
             
-            investimento_etf = min(contributo_mensile_etf_nominale, patrimonio_banca)
-            if investimento_etf > 0:
-                patrimonio_banca -= investimento_etf
-                patrimonio_etf += investimento_etf
-                etf_cost_basis += investimento_etf
-                contributi_totali_accumulati += investimento_etf
-                # SOLO contributi: positivo
-                etf_cashflow_anno += investimento_etf
+            # Si investe solo se c'è liquidità: un importo non positivo non viene investito
+            investimento_etf = np.maximum(np.minimum(contributo_mensile_etf_nominale, patrimonio_banca), 0.0)
+            patrimonio_banca -= investimento_etf
+            patrimonio_etf += investimento_etf
+            etf_cost_basis += investimento_etf
+            contributi_totali_accumulati += investimento_etf
+            # SOLO contributi: positivo
+            etf_cashflow_anno += investimento_etf
 
         # D. FASE DI PRELIEVO (prima dei rendimenti)
         if mese >= inizio_prelievo_mesi:
@@ -446,160 +513,136 @@ def _esegui_una_simulazione(parametri, prelievo_annuo_da_usare):
 
             # Imposta/aggiorna il prelievo annuale SOLO UNA VOLTA ALL'ANNO
             if (mese - inizio_prelievo_mesi) % 12 == 0:
-                if parametri['strategia_prelievo'] == 'FISSO':
-                    prelievo_annuo_nominale_corrente = prelievo_annuo_da_usare * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-                elif parametri['strategia_prelievo'] == 'REGOLA_4_PERCENTO':
+                fattore_inflazione = indice_prezzi if indicizza_inflazione else 1
+                if strategia_prelievo == 'FISSO':
+                    prelievo_annuo_nominale_corrente = prelievo_annuo_da_usare * fattore_inflazione * np.ones(n_sim)
+                elif strategia_prelievo == 'REGOLA_4_PERCENTO':
                     patrimonio_a_inizio_anno = patrimonio_banca + patrimonio_etf
-                    prelievo_annuo_nominale_corrente = patrimonio_a_inizio_anno * parametri['percentuale_regola_4'] * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-                elif parametri['strategia_prelievo'] == 'GUARDRAIL':
+                    prelievo_annuo_nominale_corrente = patrimonio_a_inizio_anno * parametri['percentuale_regola_4'] * fattore_inflazione
+                elif strategia_prelievo == 'GUARDRAIL':
                     patrimonio_a_inizio_anno = patrimonio_banca + patrimonio_etf
                     prelievo_annuo_nominale_iniziale = patrimonio_a_inizio_anno * parametri['percentuale_regola_4']
-                    if mese == inizio_prelievo_mesi:
-                        indice_prezzi_inizio_pensione = indice_prezzi
-                        prelievo_annuo_nominale_corrente = prelievo_annuo_nominale_iniziale * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-                    else:
-                        anni_da_prelievo = (mese - inizio_prelievo_mesi) // 12
-                        if anni_da_prelievo >= 3:
-                            patrimonio_attuale = patrimonio_banca + patrimonio_etf
+                    prelievo_base = prelievo_annuo_nominale_iniziale * fattore_inflazione
+                    anni_da_prelievo = (mese - inizio_prelievo_mesi) // 12
+                    if anni_da_prelievo >= 3:
+                        patrimonio_attuale = patrimonio_banca + patrimonio_etf
+                        with np.errstate(divide='ignore', invalid='ignore'):
                             trend_mercato = patrimonio_attuale / (prelievo_annuo_nominale_iniziale / parametri['percentuale_regola_4'])
-                            banda_guardrail = parametri.get('banda_guardrail', 0.10)
-                            if trend_mercato > (1 + banda_guardrail):
-                                prelievo_annuo_nominale_corrente = prelievo_annuo_nominale_iniziale * (1 + banda_guardrail * 0.5) * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-                            elif trend_mercato < (1 - banda_guardrail):
-                                prelievo_annuo_nominale_corrente = prelievo_annuo_nominale_iniziale * (1 - banda_guardrail * 0.5) * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-                            else:
-                                prelievo_annuo_nominale_corrente = prelievo_annuo_nominale_iniziale * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-                        else:
-                            prelievo_annuo_nominale_corrente = prelievo_annuo_nominale_iniziale * (indice_prezzi if parametri.get('indicizza_contributi_inflazione', True) else 1)
-
-            prelievo_mensile_target = prelievo_annuo_nominale_corrente / 12 if prelievo_annuo_nominale_corrente > 0 else 0
-            if prelievo_mensile_target > 0:
-                prelevato_da_banca = min(prelievo_mensile_target, patrimonio_banca)
-                patrimonio_banca -= prelevato_da_banca
-                fabbisogno_da_etf = prelievo_mensile_target - prelevato_da_banca
-                prelevato_da_etf_netto = 0
-                if fabbisogno_da_etf > 0 and patrimonio_etf > 0:
-                    cost_basis_ratio = etf_cost_basis / patrimonio_etf if patrimonio_etf > 0 else 1.0
-                    tasse_implicite = (1 - cost_basis_ratio) * parametri['tassazione_capital_gain']
-                    importo_lordo_da_vendere = fabbisogno_da_etf / (1 - tasse_implicite) if (1 - tasse_implicite) > 0 else float('inf')
-                    importo_venduto = min(importo_lordo_da_vendere, patrimonio_etf)
-                    # SOLO prelievi netti: negativo
-                    etf_cashflow_anno -= importo_venduto
-                    if importo_venduto > 0:
-                        costo_proporzionale = (importo_venduto / patrimonio_etf) * etf_cost_basis
-                        plusvalenza = importo_venduto - costo_proporzionale
-                        tasse = plusvalenza * parametri['tassazione_capital_gain']
-                        prelevato_da_etf_netto = importo_venduto - tasse
-                        patrimonio_etf -= importo_venduto
-                        etf_cost_basis -= costo_proporzionale
-                prelievo_totale_mese = prelevato_da_banca + prelevato_da_etf_netto
-                dati_annuali['prelievi_target_nominali'][anno_corrente] += prelievo_mensile_target
-                dati_annuali['prelievi_effettivi_nominali'][anno_corrente] += prelievo_totale_mese
-                dati_annuali['prelievi_effettivi_reali'][anno_corrente] += prelievo_totale_mese / indice_prezzi
-                dati_annuali['prelievi_da_banca_nominali'][anno_corrente] += prelevato_da_banca
-                dati_annuali['prelievi_da_etf_nominali'][anno_corrente] += prelevato_da_etf_netto
-                dati_annuali['reddito_totale_reale'][anno_corrente] += prelievo_totale_mese / indice_prezzi
+                        banda_guardrail = parametri.get('banda_guardrail', 0.10)
+                        prelievo_annuo_nominale_corrente = np.where(
+                            trend_mercato > (1 + banda_guardrail), prelievo_base * (1 + banda_guardrail * 0.5),
+                            np.where(trend_mercato < (1 - banda_guardrail), prelievo_base * (1 - banda_guardrail * 0.5), prelievo_base)
+                        )
+                    else:
+                        prelievo_annuo_nominale_corrente = prelievo_base
+
+            prelievo_mensile_target = np.where(prelievo_annuo_nominale_corrente > 0, prelievo_annuo_nominale_corrente / 12, 0.0)
+            da_prelevare = prelievo_mensile_target > 0
+            prelevato_da_banca = np.where(da_prelevare, np.minimum(prelievo_mensile_target, patrimonio_banca), 0.0)
+            patrimonio_banca -= prelevato_da_banca
+            fabbisogno_da_etf = prelievo_mensile_target - prelevato_da_banca
+
+            # Vendita di ETF per coprire la parte non coperta dal conto corrente
+            da_vendere = da_prelevare & (fabbisogno_da_etf > 0) & (patrimonio_etf > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                cost_basis_ratio = np.where(patrimonio_etf > 0, etf_cost_basis / patrimonio_etf, 1.0)
+                tasse_implicite = (1 - cost_basis_ratio) * tassazione_capital_gain
+                importo_lordo_da_vendere = np.where((1 - tasse_implicite) > 0, fabbisogno_da_etf / (1 - tasse_implicite), np.inf)
+                importo_venduto = np.where(da_vendere, np.minimum(importo_lordo_da_vendere, patrimonio_etf), 0.0)
+                # SOLO prelievi netti: negativo
+                etf_cashflow_anno -= importo_venduto
+                venduto = importo_venduto > 0
+                costo_proporzionale = np.where(venduto, (importo_venduto / patrimonio_etf) * etf_cost_basis, 0.0)
+            plusvalenza = importo_venduto - costo_proporzionale
+            tasse = plusvalenza * tassazione_capital_gain
+            prelevato_da_etf_netto = importo_venduto - tasse
+            patrimonio_etf -= importo_venduto
+            etf_cost_basis -= costo_proporzionale
+
+            prelievo_totale_mese = prelevato_da_banca + prelevato_da_etf_netto
+            dati_annuali['prelievi_target_nominali'][:, anno_corrente] += prelievo_mensile_target
+            dati_annuali['prelievi_effettivi_nominali'][:, anno_corrente] += prelievo_totale_mese
+            dati_annuali['prelievi_effettivi_reali'][:, anno_corrente] += prelievo_totale_mese / indice_prezzi
+            dati_annuali['prelievi_da_banca_nominali'][:, anno_corrente] += prelevato_da_banca
+            dati_annuali['prelievi_da_etf_nominali'][:, anno_corrente] += prelevato_da_etf_netto
+            dati_annuali['reddito_totale_reale'][:, anno_corrente] += prelievo_totale_mese / indice_prezzi
 
         # E. RENDIMENTI, COSTI E AGGIORNAMENTO INFLAZIONE
-        market_regime = market_regime_definitions[current_market_regime]
-        inflation_regime = inflation_regime_definitions[current_inflation_regime]
-
-        # --- SCEGLI I PARAMETRI DI RENDIMENTO/VOlATILITÀ DA USARE ---
-        if modalita_parametri == 'Solo Modello Economico':
-            mean_mese = market_regime['mean'] / 12
-            vol_mese = market_regime['vol'] / np.sqrt(12)
-        elif modalita_parametri == 'Solo Portafoglio ETF':
-            mean_mese = rendimento_portafoglio / 12
-            vol_mese = volatilita_portafoglio / np.sqrt(12)
-        else:  # Combinazione Pesata
-            mean_mese = (peso_azioni * market_regime['mean'] + (1 - peso_azioni) * rendimento_portafoglio) / 12
-            vol_mese = (peso_azioni * market_regime['vol'] + (1 - peso_azioni) * volatilita_portafoglio) / np.sqrt(12)
-
-        rendimento_mensile = np.random.normal(mean_mese, vol_mese)
-        inflazione_mensile = np.random.normal(inflation_regime['mean'] / 12, inflation_regime['vol'] / np.sqrt(12))
+        rendimento_mensile = (
+            medie_mensili[current_market_regime]
+            + vol_mensili[current_market_regime] * shock_rendimenti[mese - 1]
+        )
+        inflazione_mensile = (
+            medie_inflazione_mensili[current_inflation_regime]
+            + vol_inflazione_mensili[current_inflation_regime] * shock_inflazione[mese - 1]
+        )
         
         patrimonio_etf *= (1 + rendimento_mensile)
-        patrimonio_etf -= patrimonio_etf * (parametri['ter_etf'] / 12)
+        patrimonio_etf -= patrimonio_etf * ter_etf_mensile
         
         # Applica costo fisso ETF mensile
-        costo_fisso_mensile = parametri.get('costo_fisso_etf_mensile', 0.0)
         if costo_fisso_mensile > 0:
             patrimonio_banca -= costo_fisso_mensile
         
         # Applica imposte di bollo (annuali, a fine anno)
         if mese % 12 == 0:
             # Imposta di bollo titoli
-            if patrimonio_etf > 0:
-                imposta_bollo_titoli = patrimonio_etf * parametri.get('imposta_bollo_titoli', 0.002)
-                patrimonio_etf -= imposta_bollo_titoli
+            patrimonio_etf -= np.where(patrimonio_etf > 0, patrimonio_etf * parametri.get('imposta_bollo_titoli', 0.002), 0.0)
             
             # Imposta di bollo conto (se giacenza > 5000€)
-            if patrimonio_banca > 5000:
-                imposta_bollo_conto = parametri.get('imposta_bollo_conto', 34.20)
-                patrimonio_banca -= imposta_bollo_conto
+            patrimonio_banca -= np.where(patrimonio_banca > 5000, parametri.get('imposta_bollo_conto', 34.20), 0.0)
         
         indice_prezzi *= (1 + inflazione_mensile)
 
-        current_market_regime = _choose_next_regime(current_market_regime, market_regime_definitions)
-        current_inflation_regime = _choose_next_regime(current_inflation_regime, inflation_regime_definitions)
+        current_market_regime = _choose_next_regime(current_market_regime, transizioni_mercato, estrazioni_mercato[mese - 1])
+        current_inflation_regime = _choose_next_regime(current_inflation_regime, transizioni_inflazione, estrazioni_inflazione[mese - 1])
         
         # F. RIBILANCIAMENTO ANNUALE (eccetto strategia NESSUNO)
-        if mese % 12 == 0 and parametri.get('strategia_ribilanciamento', 'GLIDEPATH') != 'NESSUNO':
-            allocazioni_annuali = _calcola_allocazione_annuale(parametri)
-            allocazione_target = allocazioni_annuali[anno_corrente - 1] if anno_corrente > 0 else allocazioni_annuali[0]
+        if mese % 12 == 0 and ribilancia:
+            allocazione_target = allocazioni_annuali[anno_corrente - 1]
             
             patrimonio_totale = patrimonio_banca + patrimonio_etf
             patrimonio_target_etf = patrimonio_totale * allocazione_target
             
             # Calcolo trasferimenti per ribilanciamento
-            if patrimonio_etf > patrimonio_target_etf:
-                # Troppo ETF: vendo ETF per comprare liquidità
-                trasferimento = patrimonio_etf - patrimonio_target_etf
-                
-                # Calcola tasse sul capital gain
-                if patrimonio_etf > 0 and etf_cost_basis > 0:
-                    costo_proporzionale = (trasferimento / patrimonio_etf) * etf_cost_basis
-                    plusvalenza = trasferimento - costo_proporzionale
-                    tasse_rebalance = max(0, plusvalenza) * parametri['tassazione_capital_gain']
-                    
-                    patrimonio_etf -= trasferimento
-                    patrimonio_banca += trasferimento - tasse_rebalance
-                    etf_cost_basis -= costo_proporzionale
-                    
-                    # Track vendite di ribilanciamento
-                    dati_annuali['vendite_rebalance_nominali'][anno_corrente] += trasferimento
-                else:
-                    patrimonio_etf -= trasferimento
-                    patrimonio_banca += trasferimento
-                    dati_annuali['vendite_rebalance_nominali'][anno_corrente] += trasferimento
+            # Troppo ETF: vendo ETF per comprare liquidità
+            trasferimento_vendita = np.maximum(patrimonio_etf - patrimonio_target_etf, 0.0)
+            # Troppa liquidità: vendo liquidità per comprare ETF
+            trasferimento_acquisto = np.maximum(patrimonio_target_etf - patrimonio_etf, 0.0)
+
+            # Calcola tasse sul capital gain (solo se c'è un cost basis da ripartire)
+            con_cost_basis = (trasferimento_vendita > 0) & (patrimonio_etf > 0) & (etf_cost_basis > 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                costo_proporzionale = np.where(con_cost_basis, (trasferimento_vendita / patrimonio_etf) * etf_cost_basis, 0.0)
+            plusvalenza = trasferimento_vendita - costo_proporzionale
+            tasse_rebalance = np.where(con_cost_basis, np.maximum(0, plusvalenza) * tassazione_capital_gain, 0.0)
+
+            patrimonio_etf += trasferimento_acquisto - trasferimento_vendita
+            patrimonio_banca += trasferimento_vendita - tasse_rebalance - trasferimento_acquisto
+            etf_cost_basis += trasferimento_acquisto - costo_proporzionale
             
-            elif patrimonio_etf < patrimonio_target_etf:
-                # Troppo liquidità: vendo liquidità per comprare ETF
-                trasferimento = patrimonio_target_etf - patrimonio_etf
-                patrimonio_banca -= trasferimento
-                patrimonio_etf += trasferimento
-                etf_cost_basis += trasferimento  # Aggiorna cost basis
+            # Track vendite di ribilanciamento
+            dati_annuali['vendite_rebalance_nominali'][:, anno_corrente] += trasferimento_vendita
         
         # G. OPERAZIONI DI FINE ANNO
         if mese % 12 == 0:
             # Crescita annuale e contributo al fondo pensione (se attivo)
-            if parametri.get('attiva_fondo_pensione', False):
+            if attiva_fondo_pensione:
                 # La crescita viene applicata solo se il fondo non è stato ancora liquidato
-                if patrimonio_fp > 0:
-                    rendimento_fp = np.random.normal(
-                        parametri.get('rendimento_medio_fp', 0.04),
-                        parametri.get('volatilita_fp', 0.08)
-                    )
-                    patrimonio_fp *= (1 + rendimento_fp)
-                    patrimonio_fp -= patrimonio_fp * parametri.get('ter_fp', 0.01)
-                    
-                    # Applica tassazione sui rendimenti (se configurata)
-                    tassazione_rendimenti_fp = parametri.get('tassazione_rendimenti_fp', 0.20)
-                    if tassazione_rendimenti_fp > 0:
-                        rendimento_netto = patrimonio_fp - contributi_totali_fp
-                        if rendimento_netto > 0:
-                            tasse_rendimenti = rendimento_netto * tassazione_rendimenti_fp
-                            patrimonio_fp -= tasse_rendimenti
+                in_crescita = patrimonio_fp > 0
+                rendimento_fp = (
+                    parametri.get('rendimento_medio_fp', 0.04)
+                    + parametri.get('volatilita_fp', 0.08) * shock_fp[anno_corrente - 1]
+                )
+                fp_cresciuto = patrimonio_fp * (1 + rendimento_fp)
+                fp_cresciuto -= fp_cresciuto * parametri.get('ter_fp', 0.01)
+                
+                # Applica tassazione sui rendimenti (se configurata)
+                tassazione_rendimenti_fp = parametri.get('tassazione_rendimenti_fp', 0.20)
+                if tassazione_rendimenti_fp > 0:
+                    rendimento_netto = fp_cresciuto - contributi_totali_fp
+                    fp_cresciuto -= np.where(rendimento_netto > 0, rendimento_netto * tassazione_rendimenti_fp, 0.0)
+                patrimonio_fp = np.where(in_crescita, fp_cresciuto, patrimonio_fp)
                 
                 # Il contributo viene aggiunto durante tutta la fase di accumulo
                 if anno_corrente < parametri['anni_inizio_prelievo']:
@@ -607,62 +650,61 @@ def _esegui_una_simulazione(parametri, prelievo_annuo_da_usare):
                     patrimonio_fp += contributo_fp
                     contributi_totali_fp += contributo_fp
 
-            patrimonio_inizio_anno = dati_annuali['saldo_banca_nominale'][anno_corrente-1] + dati_annuali['saldo_etf_nominale'][anno_corrente-1]
+            patrimonio_inizio_anno = dati_annuali['saldo_banca_nominale'][:, anno_corrente-1] + dati_annuali['saldo_etf_nominale'][:, anno_corrente-1]
             patrimonio_fine_anno = patrimonio_banca + patrimonio_etf
             
-            dati_annuali['variazione_patrimonio_percentuale'][anno_corrente] = (patrimonio_fine_anno - patrimonio_inizio_anno) / patrimonio_inizio_anno if patrimonio_inizio_anno > 0 else 0
-            dati_annuali['saldo_banca_nominale'][anno_corrente] = patrimonio_banca
-            dati_annuali['saldo_etf_nominale'][anno_corrente] = patrimonio_etf
-            dati_annuali['saldo_fp_nominale'][anno_corrente] = patrimonio_fp
-            dati_annuali['saldo_banca_reale'][anno_corrente] = patrimonio_banca / indice_prezzi
-            dati_annuali['saldo_etf_reale'][anno_corrente] = patrimonio_etf / indice_prezzi
-            dati_annuali['saldo_fp_reale'][anno_corrente] = patrimonio_fp / indice_prezzi
-            dati_annuali['indice_prezzi'][anno_corrente] = indice_prezzi
-            dati_annuali['contributi_totali_versati'][anno_corrente] = contributi_totali_accumulati
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dati_annuali['variazione_patrimonio_percentuale'][:, anno_corrente] = np.where(
+                    patrimonio_inizio_anno > 0, (patrimonio_fine_anno - patrimonio_inizio_anno) / patrimonio_inizio_anno, 0.0
+                )
+            dati_annuali['saldo_banca_nominale'][:, anno_corrente] = patrimonio_banca
+            dati_annuali['saldo_etf_nominale'][:, anno_corrente] = patrimonio_etf
+            dati_annuali['saldo_fp_nominale'][:, anno_corrente] = patrimonio_fp
+            dati_annuali['saldo_banca_reale'][:, anno_corrente] = patrimonio_banca / indice_prezzi
+            dati_annuali['saldo_etf_reale'][:, anno_corrente] = patrimonio_etf / indice_prezzi
+            dati_annuali['saldo_fp_reale'][:, anno_corrente] = patrimonio_fp / indice_prezzi
+            dati_annuali['indice_prezzi'][:, anno_corrente] = indice_prezzi
+            dati_annuali['contributi_totali_versati'][:, anno_corrente] = contributi_totali_accumulati
             
             # Calcolo rendimento puro degli investimenti (solo ETF)
             # Usiamo un metodo più semplice: confrontiamo il valore finale con quello iniziale
             # escludendo i flussi di cassa (contributi e prelievi)
-            patrimonio_investimenti_inizio = dati_annuali['saldo_etf_nominale'][anno_corrente-1]
+            patrimonio_investimenti_inizio = dati_annuali['saldo_etf_nominale'][:, anno_corrente-1]
             patrimonio_investimenti_fine = patrimonio_etf
             
+            # Il rendimento è la variazione percentuale del patrimonio ETF
+            # escludendo i flussi di cassa (contributi e prelievi)
+            # Per semplicità, assumiamo che i flussi di cassa siano distribuiti uniformemente nell'anno
+            flussi_netti_anno = etf_cashflow_anno  # Positivo per contributi, negativo per prelievi
+            patrimonio_medio_anno = patrimonio_investimenti_inizio + (flussi_netti_anno / 2)
+            
             # Calcola il rendimento solo se c'è un patrimonio iniziale
-            if patrimonio_investimenti_inizio > 0:
-                # Il rendimento è la variazione percentuale del patrimonio ETF
-                # escludendo i flussi di cassa (contributi e prelievi)
-                # Per semplicità, assumiamo che i flussi di cassa siano distribuiti uniformemente nell'anno
-                flussi_netti_anno = etf_cashflow_anno  # Positivo per contributi, negativo per prelievi
-                patrimonio_medio_anno = patrimonio_investimenti_inizio + (flussi_netti_anno / 2)
-                
-                if patrimonio_medio_anno > 0:
-                    # Rendimento = (Valore finale - Valore iniziale - Flussi netti) / Patrimonio medio
-                    rendimento_puro = (patrimonio_investimenti_fine - patrimonio_investimenti_inizio - flussi_netti_anno) / patrimonio_medio_anno
-                    dati_annuali['rendimento_investimento_percentuale'][anno_corrente] = rendimento_puro
-                else:
-                    dati_annuali['rendimento_investimento_percentuale'][anno_corrente] = 0.0
-            else:
-                dati_annuali['rendimento_investimento_percentuale'][anno_corrente] = 0.0
+            # Rendimento = (Valore finale - Valore iniziale - Flussi netti) / Patrimonio medio
+            with np.errstate(divide='ignore', invalid='ignore'):
+                dati_annuali['rendimento_investimento_percentuale'][:, anno_corrente] = np.where(
+                    (patrimonio_investimenti_inizio > 0) & (patrimonio_medio_anno > 0),
+                    (patrimonio_investimenti_fine - patrimonio_investimenti_inizio - flussi_netti_anno) / patrimonio_medio_anno,
+                    0.0
+                )
             
             # Resetta il contatore dei flussi per l'anno successivo
-            etf_cashflow_anno = 0.0
+            etf_cashflow_anno = np.zeros(n_sim)
 
     # --- 3. OUTPUT FINALE ---
     patrimonio_storico = dati_annuali['saldo_banca_nominale'] + dati_annuali['saldo_etf_nominale']
-    drawdown = 0
-    if np.any(patrimonio_storico > 0):
-        picchi = np.maximum.accumulate(patrimonio_storico)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        picchi = np.maximum.accumulate(patrimonio_storico, axis=1)
         drawdown_values = (patrimonio_storico - picchi) / picchi
-        drawdown = np.min(drawdown_values)
+    drawdown = np.where(np.any(patrimonio_storico > 0, axis=1), np.min(drawdown_values, axis=1), 0.0)
 
     return {
         "dati_annuali": dati_annuali,
         "drawdown": drawdown,
-        "fallimento": (patrimonio_banca + patrimonio_etf) <= 0 and mese >= inizio_prelievo_mesi,
+        "fallimento": ((patrimonio_banca + patrimonio_etf) <= 0) & (mese >= inizio_prelievo_mesi),
         "guadagni_accumulo": guadagni_accumulo,
         "contributi_totali_versati": contributi_totali_accumulati
     }
 
-
 def run_full_simulation(parametri, prelievo_annuo_da_usare=None):
     valida_parametri(parametri)
     
@@ -670,55 +712,51 @@ def run_full_simulation(parametri, prelievo_annuo_da_usare=None):
     if prelievo_annuo_da_usare is None:
         prelievo_annuo_da_usare = parametri['prelievo_annuo']
 
-    # Inizializzazione contenitori per i risultati aggregati
+    # Tutte le simulazioni avanzano insieme: ogni grandezza è una matrice (simulazioni x anni)
     n_sim = parametri['n_simulazioni']
-    num_anni = parametri['anni_totali']
-    tutti_i_dati_annuali = [{} for _ in range(n_sim)]
-    tutti_i_drawdown = np.zeros(n_sim)
-    tutti_i_guadagni = np.zeros(n_sim)
-    tutti_i_contributi = np.zeros(n_sim)
-    fallimenti = 0
-
-    for i in range(n_sim):
-        risultati_run = _esegui_una_simulazione(parametri, prelievo_annuo_da_usare)
-        tutti_i_dati_annuali[i] = risultati_run['dati_annuali']
-        tutti_i_drawdown[i] = risultati_run['drawdown']
-        tutti_i_guadagni[i] = risultati_run['guadagni_accumulo']
-        tutti_i_contributi[i] = risultati_run['contributi_totali_versati']
-        if risultati_run['fallimento']:
-            fallimenti += 1
-
-    patrimoni_nominali_tutte_le_run = np.array([
-        d['saldo_banca_nominale'] + d['saldo_etf_nominale'] + d['saldo_fp_nominale'] 
-        for d in tutti_i_dati_annuali
-    ])
-    patrimoni_reali_tutte_le_run = np.zeros_like(patrimoni_nominali_tutte_le_run)
-    for i in range(n_sim):
-        indici_prezzi = tutti_i_dati_annuali[i]['indice_prezzi']
-        indici_prezzi = np.maximum(indici_prezzi, 1e-10)
-        patrimoni_reali_tutte_le_run[i, :] = patrimoni_nominali_tutte_le_run[i, :] / indici_prezzi
+    rng = np.random.default_rng()
+    risultati_run = _esegui_simulazioni(parametri, prelievo_annuo_da_usare, n_sim, rng)
+    dati_annuali = risultati_run['dati_annuali']
+    tutti_i_drawdown = risultati_run['drawdown']
+    tutti_i_guadagni = risultati_run['guadagni_accumulo']
+    tutti_i_contributi = risultati_run['contributi_totali_versati']
+    fallimenti = np.count_nonzero(risultati_run['fallimento'])
+
+    patrimoni_nominali_tutte_le_run = (
+        dati_annuali['saldo_banca_nominale'] + dati_annuali['saldo_etf_nominale'] + dati_annuali['saldo_fp_nominale']
+    )
+    indici_prezzi = np.maximum(dati_annuali['indice_prezzi'], 1e-10)
+    patrimoni_reali_tutte_le_run = patrimoni_nominali_tutte_le_run / indici_prezzi
 
     patrimoni_finali_reali = patrimoni_reali_tutte_le_run[:, -1]
     patrimoni_finali_reali = np.nan_to_num(patrimoni_finali_reali, nan=0.0, posinf=0.0, neginf=0.0)
-    valore_mediano = np.median(patrimoni_finali_reali)
+    # Una sola selezione parziale per i tre percentili (np.median ne farebbe una a parte)
+    peggior_10_reale, valore_mediano, top_10_reale = np.percentile(patrimoni_finali_reali, [10, 50, 90])
     indice_mediano = np.abs(patrimoni_finali_reali - valore_mediano).argmin() if len(patrimoni_finali_reali) > 0 else 0
-    dati_mediana_dettagliati = tutti_i_dati_annuali[indice_mediano]
+    # Riga della simulazione mediana in un unico array strutturato (un campo per
+    # serie): una sola allocazione contigua, che non tiene in vita le matrici complete
+    dati_mediana_dettagliati = np.empty(
+        parametri['anni_totali'] + 1, dtype=np.dtype([(k, np.float64) for k in dati_annuali])
+    )
+    for k, v in dati_annuali.items():
+        dati_mediana_dettagliati[k] = v[indice_mediano]
 
     patrimoni_finali_nominali = patrimoni_nominali_tutte_le_run[:, -1]
+    peggior_10_nominale, mediano_nominale, top_10_nominale = np.percentile(patrimoni_finali_nominali, [10, 50, 90])
     idx_inizio_prelievo = parametri['anni_inizio_prelievo']
 
     statistiche = {
-        'patrimonio_finale_mediano_nominale': np.median(patrimoni_finali_nominali),
-        'patrimonio_finale_top_10_nominale': np.percentile(patrimoni_finali_nominali, 90),
-        'patrimonio_finale_peggior_10_nominale': np.percentile(patrimoni_finali_nominali, 10),
+        'patrimonio_finale_mediano_nominale': mediano_nominale,
+        'patrimonio_finale_top_10_nominale': top_10_nominale,
+        'patrimonio_finale_peggior_10_nominale': peggior_10_nominale,
         'patrimonio_finale_mediano_reale': valore_mediano,
-        'patrimonio_finale_top_10_reale': np.percentile(patrimoni_finali_reali, 90),
-        'patrimonio_finale_peggior_10_reale': np.percentile(patrimoni_finali_reali, 10),
+        'patrimonio_finale_top_10_reale': top_10_reale,
+        'patrimonio_finale_peggior_10_reale': peggior_10_reale,
         'patrimonio_inizio_prelievi_mediano_nominale': np.median(patrimoni_nominali_tutte_le_run[:, idx_inizio_prelievo]),
         'patrimonio_inizio_prelievi_mediano_reale': np.median(patrimoni_reali_tutte_le_run[:, idx_inizio_prelievo]),
         'probabilita_fallimento': fallimenti / n_sim if n_sim > 0 else 0,
         'drawdown_massimo_peggiore': np.min(tutti_i_drawdown) if len(tutti_i_drawdown) > 0 else 0,
-        'sharpe_ratio_medio': _calcola_sharpe_ratio_medio(tutti_i_dati_annuali),
+        'sharpe_ratio_medio': _calcola_sharpe_ratio_medio(dati_annuali['variazione_patrimonio_percentuale']),
         'patrimoni_reali_finali': patrimoni_finali_reali,
         'guadagni_accumulo_mediano_nominale': np.median(tutti_i_guadagni),
         'contributi_totali_versati_mediano_nominale': np.median(tutti_i_contributi),
@@ -726,7 +764,7 @@ def run_full_simulation(parametri, prelievo_annuo_da_usare=None):
         'prelievo_effettivamente_usato': prelievo_annuo_da_usare
     }
 
-    reddito_reale_annuo_tutte_le_run = np.array([run['reddito_totale_reale'] for run in tutti_i_dati_annuali])
+    reddito_reale_annuo_tutte_le_run = dati_annuali['reddito_totale_reale']
     statistiche_prelievi = {
         'totale_reale_medio_annuo': np.mean(reddito_reale_annuo_tutte_le_run) if reddito_reale_annuo_tutte_le_run.size > 0 else 0.0
     }